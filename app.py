@@ -1,484 +1,518 @@
-from datetime import datetime, timedelta
+from datetime import date
 import io
+import re
+import numpy as np
 import streamlit as st
 import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Font, Alignment, Border, Side
-
-st.set_page_config(
-    page_title="台灣大車隊報表整理 App",
-    page_icon="🍁",
-    layout="wide",
+from pandas.api.types import union_categoricals
+from build_jobs import submit_job
+from profiling import ordered_records, profiling
+from statement_pipeline import (
+    create_employee_archive,
+    create_employee_sheets,
+    file_digest,
+    load_statement_or_parse,
+    parse_extension_input,
+    parse_group_input,
+    read_statement_sheet,
 )
 
+# 解析快取的上限（超過時淘汰最久未使用的項目）
+PARSE_CACHE_MAX_ENTRIES = 16
 
-def parse_extension_input(extension_input):
-    extension = {}
-    for line in extension_input.split('\n'):
-        parts = line.strip().split(':')
-        if len(parts) == 2:
-            employee_id, ext = parts
-            extension[employee_id.strip()] = ext.strip()
-    return extension
-
-
-def process_dataframe(df):
-    # 找到 "旅次明細表" 所在的行
-    start_row = df[df.apply(lambda row: '旅次明細表' in str(row.values), axis=1)].index
-
-    # 找到 "總共：" 所在的行
-    end_row = df[df.apply(lambda row: str(row.values[0]).startswith('總共：'), axis=1)].index
-
-    # 尋找列帳期間
-    billing_period = ''
-    for _, row in df.iterrows():
-        if '列帳期間：' in str(row.values):
-            billing_period = row.values[1]  # 假設列帳期間在最後一列
-            break
-
-    if len(start_row) > 0 and len(end_row) > 0:
-        # 如果找到 "旅次明細表" 和 "總共："，則取中間的數據
-        start_row = start_row[0] + 1
-        end_row = end_row[0]
-        df = df.iloc[start_row:end_row].reset_index(drop=True)
-
-        # 將第一行設為列標題
-        new_header = df.iloc[0]
-        df = df[1:]
-        df.columns = new_header
-
-        # 重置索引
-        df = df.reset_index(drop=True)
-    elif len(start_row) > 0:
-        # 如果只找到 "旅次明細表"，則從該行之後開始取數據
-        start_row = start_row[0] + 1
-        df = df.iloc[start_row:].reset_index(drop=True)
-
-        # 將第一行設為列標題
-        new_header = df.iloc[0]
-        df = df[1:]
-        df.columns = new_header
-
-        # 重置索引
-        df = df.reset_index(drop=True)
-    else:
-        st.warning("未找到 '旅次明細表' 行，顯示原始數據。")
 
-    return df, billing_period
+# 以檔案內容雜湊作為快取鍵，_file_bytes 不參與雜湊計算
+@st.cache_data(max_entries=PARSE_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_sheet_names(file_hash, _file_bytes):
+    return pd.ExcelFile(io.BytesIO(_file_bytes)).sheet_names
 
 
-def display_employee_data(df):
-    employee_column = '員工編號'
-    name_column = '員工姓名'
+@st.cache_data(max_entries=PARSE_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_sheet(file_hash, sheet_name, _file_bytes):
+    return read_statement_sheet(_file_bytes, sheet_name)
 
-    if employee_column not in df.columns and name_column not in df.columns:
-        st.error(f"找不到 '{employee_column}' 或 '{name_column}' 列。請確保數據中包含這些列。")
-        return
 
-    # 獲取所有唯一的員工編號和姓名
-    employees = df[[employee_column, name_column]].drop_duplicates()
+@st.cache_data(max_entries=PARSE_CACHE_MAX_ENTRIES, show_spinner="正在解析Excel文件...")
+def load_processed_sheet(file_hash, sheet_name, _file_bytes):
+    processed_df, billing_period, memory_usage, _ = load_statement_or_parse(
+        _file_bytes, file_hash, sheet_name, st.warning
+    )
+    return processed_df, billing_period, memory_usage
+
+
+def trip_row_hashes(df):
+    # 序號只是在各對帳單中的行號，不列入比對；其餘欄位完全相同即視為同一筆旅次
+    columns = [column for column in df.columns if column != '序號']
+    # 各對帳單轉換後的欄位型別可能不同（例如有空白車資的對帳單保留 object），
+    # 先統一轉為字串再計算，相同的值在不同型別下才會得到相同的雜湊
+    values = df[columns].astype(object)
+    values = values.where(values.notna(), '').astype(str)
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+def append_trips(trips, new_trips):
+    combined = pd.concat([trips, new_trips], ignore_index=True)
+
+    # 類別不同的類別欄位合併後會變回 object，改以聯集的類別還原
+    for idx, column in enumerate(combined.columns):
+        if column in trips.columns and column in new_trips.columns:
+            old_values, new_values = trips[column], new_trips[column]
+            if isinstance(old_values.dtype, pd.CategoricalDtype) and isinstance(
+                new_values.dtype, pd.CategoricalDtype
+            ):
+                combined.isetitem(
+                    idx, union_categoricals([old_values, new_values], ignore_order=True)
+                )
+    return combined
+
+
+def new_consolidation():
+    return {
+        'sources': [],
+        'trips': None,
+        'row_hashes': np.empty(0, dtype=np.uint64),
+        'employee_index': None,
+    }
+
+
+def ingest_statement(consolidation, source, label, df, billing_period):
+    # 只處理新加入對帳單的各行，與已合併的旅次重複者略過
+    hashes = trip_row_hashes(df)
+    keep = ~np.isin(hashes, consolidation['row_hashes'])
+    new_trips = df[keep].reset_index(drop=True)
+
+    if consolidation['trips'] is None:
+        consolidation['trips'] = new_trips
+    elif len(new_trips):
+        consolidation['trips'] = append_trips(consolidation['trips'], new_trips)
+    consolidation['row_hashes'] = np.concatenate([consolidation['row_hashes'], hashes[keep]])
+    consolidation['employee_index'] = None
+    consolidation['sources'].append(
+        {
+            'source': source,
+            'label': label,
+            'billing_period': billing_period,
+            'rows': len(df),
+            'added': int(keep.sum()),
+        }
+    )
+    return consolidation
 
-    # 創建一個包含員工編號和姓名的選項列表
-    employee_options = [
-        f"{row[employee_column]} - {row[name_column]}" for _, row in employees.iterrows()
-    ]
 
-    # 創建一個選擇框讓用戶選擇要查看的員工
-    selected_employee = st.selectbox("選擇員工", employee_options)
+BILLING_DATE_RE = re.compile(r'(\d{4})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日')
 
-    # 從選擇的選項中提員工編號
-    selected_employee_id = selected_employee.split(' - ')[0]
 
-    # 顯示選中員工的數據
-    employee_data = df[df[employee_column] == selected_employee_id]
-    st.subheader(f"員工 {selected_employee} 的數據")
-    st.dataframe(employee_data)
+def combine_billing_periods(periods):
+    # 合併後的列帳期間為最早的起日到最晚的迄日；無法解析時列出所有期間
+    parsed = []
+    for period in periods:
+        matches = list(BILLING_DATE_RE.finditer(period)) if isinstance(period, str) else []
+        if len(matches) != 2:
+            return '、'.join(dict.fromkeys(str(period) for period in periods))
+        start, end = [date(*map(int, match.groups())) for match in matches]
+        parsed.append((start, end, period, matches))
+
+    _, _, first_period, first_matches = min(parsed, key=lambda item: item[0])
+    _, _, last_period, last_matches = max(parsed, key=lambda item: item[1])
+    separator = first_period[first_matches[0].end() : first_matches[1].start()]
+    return first_matches[0].group(0) + separator + last_matches[1].group(0)
 
 
-def create_employee_sheets(df, billing_period, original_file, grouped_employees, extension):
+def build_employee_index(df):
     employee_column = '員工編號'
     name_column = '員工姓名'
+    fare_column = '折扣後車資'
 
     if employee_column not in df.columns or name_column not in df.columns:
-        st.error(f"找不到 '{employee_column}' 或 '{name_column}' 列。請確保數據中包含這些列。")
         return None
 
-    # 加載原始工作簿
-    workbook = load_workbook(original_file)
+    # 一次 groupby 取得每位員工的行位置、筆數與車資合計，查看員工資料時不必再掃描整份資料
+    grouped = df.groupby(employee_column, sort=False, observed=True)
+    positions = grouped.indices
+    if fare_column in df.columns:
+        totals = grouped[fare_column].sum().to_dict()
+    else:
+        totals = {}
 
-    summary_sheet = workbook.create_sheet("總表")
-    end_date_str = billing_period.split('~')[1].strip()
-    end_date = datetime.strptime(end_date_str, "%Y 年 %m 月 %d 日")
+    # 獲取所有唯一的員工編號和姓名，並建立選項與員工編號的對應
+    employees = df[[employee_column, name_column]].drop_duplicates()
+    options = {
+        f"{employee_id} - {name}": employee_id
+        for employee_id, name in zip(employees[employee_column], employees[name_column])
+    }
+
+    return {
+        'options': options,
+        'employee_ids': sorted(positions),
+        'positions': positions,
+        'totals': totals,
+    }
+
+
+# 員工索引與整理後的對帳單一起快取，_df 不參與雜湊計算
+@st.cache_data(max_entries=PARSE_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_employee_index(file_hash, sheet_name, _df):
+    return build_employee_index(_df)
+
+
+# 預覽時每頁顯示的行數
+PREVIEW_PAGE_ROWS = 200
+
+
+def column_summary(df):
+    rows = []
+    for idx, column in enumerate(df.columns):
+        values = df.iloc[:, idx]
+        summary = {
+            '欄位': str(column),
+            '型別': str(values.dtype),
+            '非空值': int(values.count()),
+            '相異值': int(values.nunique()),
+            '最小值': '',
+            '最大值': '',
+            '合計': '',
+        }
+        # 數值與日期欄位才計算範圍；文字欄位的最小最大值沒有意義
+        if pd.api.types.is_bool_dtype(values):
+            pass
+        elif pd.api.types.is_numeric_dtype(values):
+            summary.update(
+                {
+                    '最小值': str(values.min()),
+                    '最大值': str(values.max()),
+                    '合計': str(values.sum()),
+                }
+            )
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            summary.update({'最小值': str(values.min()), '最大值': str(values.max())})
+        rows.append(summary)
+    return pd.DataFrame(rows)
 
-    current_year_month = end_date.strftime("%Y/%m")
-    today = (end_date + timedelta(days=1)).strftime("%Y/%m/%d")
 
-    fixed_rows = [
-        ['台灣大車隊乘車費總表', '', '', current_year_month],
-        ['列帳期間：', '', '', billing_period],
-        ['收據日期', '', '', today],
-    ]
+# 欄位摘要以資料來源作為快取鍵，_df 不參與雜湊計算
+@st.cache_data(max_entries=PARSE_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_column_summary(summary_key, _df):
+    return column_summary(_df)
 
-    for i, row in enumerate(fixed_rows):
-        summary_sheet.append(row)
-        summary_sheet.merge_cells(f'A{i+1}:C{i+1}')
-        summary_sheet.merge_cells(f'D{i+1}:G{i+1}')
 
-    summary_sheet.append(["NO", "員工姓名", "工號", "聯絡電話", "筆數", "折扣後車資", "ACK"])
+def show_preview(df, key, summary_key):
+    # 只把一頁的資料送到瀏覽器，使用者要求時才傳送全部數據
+    with st.expander("欄位摘要"):
+        st.dataframe(load_column_summary(summary_key, df), hide_index=True)
 
-    summary_data = []
+    total = len(df)
+    if st.toggle(f"顯示全部數據（共 {total} 筆）", key=f"{key}_all"):
+        st.dataframe(df)
+        return
 
-    # 處理分組的員工
-    for group, employees in grouped_employees.items():
-        if not employees:
-            continue
+    pages = max(1, -(-total // PREVIEW_PAGE_ROWS))
+    page = 1
+    if pages > 1:
+        # 頁數改變（例如換了工作表）時重新從第一頁開始
+        page = st.number_input(
+            f"頁數（共 {pages} 頁）",
+            min_value=1,
+            max_value=pages,
+            value=1,
+            key=f"{key}_page_{pages}",
+        )
+    start = (page - 1) * PREVIEW_PAGE_ROWS
+    st.dataframe(df.iloc[start : start + PREVIEW_PAGE_ROWS])
+    st.caption(
+        f"顯示第 {min(start + 1, total)}–{min(start + PREVIEW_PAGE_ROWS, total)} 筆，共 {total} 筆"
+    )
 
-        # 使用 grouped_employees 中的第一個員工編號作為代表
-        first_employee_id = employees[0]
-        group_df = df[df[employee_column].isin(employees)]
 
-        if group_df.empty:
-            continue
+def display_employee_data(df, employee_index):
+    employee_column = '員工編號'
+    name_column = '員工姓名'
 
-        # 獲取第一個員工的資訊
-        first_employee_data = group_df[group_df[employee_column] == first_employee_id].iloc[0]
-        first_employee_name = first_employee_data[name_column]
+    if employee_index is None:
+        st.error(f"找不到 '{employee_column}' 或 '{name_column}' 列。請確保數據中包含這些列。")
+        return
 
-        total_count = len(group_df)
-        total_amount = group_df['折扣後車資'].sum() if '折扣後車資' in group_df.columns else 0
+    # 創建一個選擇框讓用戶選擇要查看的員工
+    selected_employee = st.selectbox("選擇員工", list(employee_index['options']))
+    if selected_employee is None:
+        return
+    selected_employee_id = employee_index['options'][selected_employee]
 
-        summary_data.append(
-            [
-                len(summary_data) + 1,
-                first_employee_name,
-                first_employee_id,
-                extension.get(first_employee_id, ""),
-                total_count,
-                total_amount,
-                "",
-            ]
-        )
+    # 顯示選中員工的數據（直接以索引中的行位置取出）
+    positions = employee_index['positions'].get(selected_employee_id, [])
+    employee_data = df.iloc[positions]
+    st.subheader(f"員工 {selected_employee} 的數據")
+    total = employee_index['totals'].get(selected_employee_id)
+    if total is not None:
+        st.caption(f"共 {len(positions)} 筆，折扣後車資合計 {total}")
+    else:
+        st.caption(f"共 {len(positions)} 筆")
+    st.dataframe(employee_data)
 
-        sheet_name = f'{first_employee_id} {first_employee_name}'
-        worksheet = workbook.create_sheet(sheet_name)
-
-        # 创建固定的行内容
-        fixed_rows = [
-            ['企業會員乘車服務電子對帳單'],
-            ['客戶名稱：', '', '友訊科技股份有限公司'],
-            ['列帳期間：', '', billing_period],
-        ]
-
-        # 将固定行内容写入工作表
-        for row in fixed_rows:
-            worksheet.append(row)
-
-        # 將組內所有員工的數據寫入工作表，按照員工編號排序
-        sorted_group_df = group_df.sort_values(by=employee_column)
-        worksheet.append(sorted_group_df.columns.tolist())
-        for _, row in sorted_group_df.iterrows():
-            worksheet.append(row.tolist())
-
-        # 计算统计数据
-        total_count = len(sorted_group_df)
-        total_amount = (
-            sorted_group_df['折扣後車資'].sum() if '折扣後車資' in sorted_group_df.columns else 0
-        )
 
-        # 创建统计数据行
-        stats_rows = [
-            ['總筆數', total_count, '', '', '', '', '折扣後：', total_amount],
-            [],
-            ['*車資總計(運送服務費)：', '', '', '', '', '', f"{total_amount}元"],
-            ['乘車券印製費：', '', '', '', '', '', '0元'],
-            ['滯納金：', '', '', '', '', '', '0元'],
-            ['其它費用：', '', '', '', '', '', '0元'],
-            ['本期應繳帳款：', '', '', '', '', '', f"{total_amount}元"],
-            ['特殊費用：', '', '', '', '', '', '0元'],
-        ]
-
-        # 写入统计数据行
-        for row in stats_rows:
-            worksheet.append(row)
-
-        # 设置字体大小和调整列宽
-        for row in worksheet.iter_rows():
-            for cell in row:
-                cell.font = Font(size=12)
-
-        for idx, column in enumerate(sorted_group_df.columns):
-            column_letter = get_column_letter(idx + 1)
-            if column in ['上車地點', '下車地點']:
-                worksheet.column_dimensions[column_letter].width = 12
-            else:
-                max_length = max(
-                    sorted_group_df[column].astype(str).map(len).max() + 4, len(str(column)) + 6
-                )
-                worksheet.column_dimensions[column_letter].width = max_length
-
-        # 合併第一行單元格並置中
-        max_col = len(sorted_group_df.columns)
-        worksheet.merge_cells(f'A1:{get_column_letter(max_col)}1')
-        title_cell = worksheet['A1']
-        title_cell.alignment = Alignment(horizontal='center', vertical='center')
-        worksheet.merge_cells(f'C2:{get_column_letter(max_col)}2')
-        worksheet.merge_cells(f'C3:{get_column_letter(max_col)}3')
-
-        # 设第一行为粗体
-        bold_font = Font(size=12, bold=True)
-        title_cell.font = bold_font
-        start_row = len(fixed_rows) + len(sorted_group_df) + 2
-        total_count_cell = worksheet.cell(row=start_row, column=1)
-        total_count_cell.font = bold_font
-        total_count_cell = worksheet.cell(row=start_row, column=2)
-        total_count_cell.font = bold_font
-        total_amount_cell = worksheet.cell(row=start_row, column=7)
-        total_amount_cell.font = bold_font
-        total_amount_cell = worksheet.cell(row=start_row, column=8)
-        total_amount_cell.font = bold_font
-        payable_amount_cell = worksheet.cell(row=start_row + 6, column=1)
-        payable_amount_cell.font = bold_font
-        payable_amount_value_cell = worksheet.cell(row=start_row + 6, column=7)
-        payable_amount_value_cell.font = bold_font
-
-        # 添加外框线
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin'),
-        )
+# 輸出方式：單一工作簿，或每位員工（分組）各一個工作簿的 ZIP
+WORKBOOK_OUTPUT = "單一Excel文件"
+ARCHIVE_OUTPUT = "每位員工一個Excel文件（ZIP）"
 
-        # 为数据部分添加全部框线
-        for row in worksheet[f'A1':f'{get_column_letter(max_col)}{worksheet.max_row}']:
-            for cell in row:
-                cell.border = thin_border
 
-    # 處理未分組的員工
-    ungrouped_employees = set(df[employee_column]) - set(
-        employee for group in grouped_employees.values() for employee in group
-    )
-    for employee in ungrouped_employees:
-        employee_df = df[df[employee_column] == employee]
-        employee_name = employee_df[name_column].iloc[0]
+def report_cache_key(sources, grouped_employees, extension, output_mode=WORKBOOK_OUTPUT):
+    groups = tuple((name, tuple(members)) for name, members in grouped_employees.items())
+    return tuple(sources), groups, tuple(sorted(extension.items())), output_mode
 
-        total_count = len(employee_df)
-        total_amount = employee_df['折扣後車資'].sum() if '折扣後車資' in employee_df.columns else 0
 
-        summary_data.append(
-            [
-                len(summary_data) + 1,
-                employee_name,
-                employee,
-                extension.get(employee, ""),
-                total_count,
-                total_amount,
-                "",
-            ]
-        )
-
-        sheet_name = f'{employee} {employee_name}'
-        worksheet = workbook.create_sheet(sheet_name)
-
-        # 创建固定的行内容
-        fixed_rows = [
-            ['企業會員乘車服務電子對帳單'],
-            ['客戶名稱：', '', '友訊科技股份有限公司'],
-            ['列帳期間：', '', billing_period],
-        ]
-
-        # 将固定行内容写入工作表
-        for row in fixed_rows:
-            worksheet.append(row)
-
-        # 重置 employee_df 的索引并保留原始列名
-        employee_df_reset = employee_df.reset_index(drop=True)
-
-        # 将员工数据包括标题）写入工作表
-        worksheet.append(employee_df_reset.columns.tolist())
-        for _, row in employee_df_reset.iterrows():
-            worksheet.append(row.tolist())
-
-        # 计算统计数据
-        total_count = len(employee_df_reset)
-        total_amount = (
-            employee_df_reset['折扣後車資'].sum()
-            if '折扣後車資' in employee_df_reset.columns
-            else 0
+# 在背景執行緒中執行：資料本身由 report_key 中的對帳單來源決定
+def build_report(report_key, df, billing_period, original_bytes, progress):
+    _, groups, extension, output_mode = report_key
+    grouped_employees = {name: list(members) for name, members in groups}
+    if output_mode == ARCHIVE_OUTPUT:
+        output = create_employee_archive(
+            df, billing_period, grouped_employees, dict(extension), progress=progress
         )
-
-        # 创建统计数据行
-        stats_rows = [
-            ['總筆數', total_count, '', '', '', '', '折扣後：', total_amount],
-            [],
-            ['*車資總計(運送服務費)：', '', '', '', '', '', f"{total_amount}元"],
-            ['乘車券印製費：', '', '', '', '', '', '0元'],
-            ['滯納金：', '', '', '', '', '', '0元'],
-            ['其它費用：', '', '', '', '', '', '0元'],
-            ['本期應繳帳款：', '', '', '', '', '', f"{total_amount}元"],
-            ['特殊費用：', '', '', '', '', '', '0元'],
-        ]
-
-        # 写入统计数据行
-        for row in stats_rows:
-            worksheet.append(row)
-
-        # 设置字体大小和调整列宽
-        for row in worksheet.iter_rows():
-            for cell in row:
-                cell.font = Font(size=12)
-
-        for idx, column in enumerate(employee_df_reset.columns):
-            column_letter = get_column_letter(idx + 1)
-            if column in ['上車地點', '下車地點']:
-                worksheet.column_dimensions[column_letter].width = 12
-            else:
-                max_length = max(
-                    employee_df_reset[column].astype(str).map(len).max() + 4, len(str(column)) + 6
-                )
-                worksheet.column_dimensions[column_letter].width = max_length
-
-        # 合併第一行單元格並置中
-        max_col = len(employee_df_reset.columns)
-        worksheet.merge_cells(f'A1:{get_column_letter(max_col)}1')
-        title_cell = worksheet['A1']
-        title_cell.alignment = Alignment(horizontal='center', vertical='center')
-        worksheet.merge_cells(f'C2:{get_column_letter(max_col)}2')
-        worksheet.merge_cells(f'C3:{get_column_letter(max_col)}3')
-
-        # 设置第一行为粗体
-        bold_font = Font(size=12, bold=True)
-        title_cell.font = bold_font
-        start_row = len(fixed_rows) + len(employee_df_reset) + 2
-        total_count_cell = worksheet.cell(row=start_row, column=1)
-        total_count_cell.font = bold_font
-        total_count_cell = worksheet.cell(row=start_row, column=2)
-        total_count_cell.font = bold_font
-        total_amount_cell = worksheet.cell(row=start_row, column=7)
-        total_amount_cell.font = bold_font
-        total_amount_cell = worksheet.cell(row=start_row, column=8)
-        total_amount_cell.font = bold_font
-        payable_amount_cell = worksheet.cell(row=start_row + 6, column=1)
-        payable_amount_cell.font = bold_font
-        payable_amount_value_cell = worksheet.cell(row=start_row + 6, column=7)
-        payable_amount_value_cell.font = bold_font
-
-        # 添加外框线
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin'),
+    else:
+        original_file = io.BytesIO(original_bytes) if original_bytes is not None else None
+        output = create_employee_sheets(
+            df, billing_period, original_file, grouped_employees, dict(extension), progress=progress
         )
+    if output is None:
+        return None
 
-        # 为数据部分添加全部框线
-        for row in worksheet[f'A1':f'{get_column_letter(max_col)}{worksheet.max_row}']:
-            for cell in row:
-                cell.border = thin_border
-
-    # 根據員工編號排序 summary_data
-    summary_data.sort(key=lambda x: x[2])  # x[2] 是員工編號
-
-    # 將排序後的 summary_data 寫入總表
-    for i, row in enumerate(summary_data, start=1):
-        row[0] = i  # 更新序號
-        summary_sheet.append(row)
-
-    # 计算总计
-    total_count = sum(row[4] for row in summary_data)
-    total_amount = sum(row[5] for row in summary_data)
-    summary_sheet.append(["合計", "", "", "", total_count, total_amount, ""])
-    summary_sheet.merge_cells(f"A{len(summary_data) + 5}:D{len(summary_data) + 5}")
-
-    # 设置总表格式
-    for row in summary_sheet.iter_rows(
-        min_row=1, max_row=len(summary_data) + 5, min_col=1, max_col=7
-    ):
-        for cell in row:
-            cell.font = Font(size=12)
-            cell.border = Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin'),
-            )
-
-    for row in summary_sheet.iter_rows(min_row=1, max_row=3):
-        for col, cell in enumerate(row, start=1):
-            if col == 1:
-                cell.alignment = Alignment(horizontal='right', vertical='center')
-            elif col == 4:
-                cell.alignment = Alignment(horizontal='left', vertical='center')
+    # 只讀出一份完整內容：保存的工作結果與下載按鈕共用同一個 bytes 物件。
+    # download_button 無法串流，ZIP 也須等所有工作簿完成後才能下載，整份內容會留在記憶體中
+    with output:
+        return output.read()
 
-    for row in summary_sheet.iter_rows(min_row=4):
-        for cell in row:
-            cell.alignment = Alignment(horizontal='center', vertical='center')
 
-    # 在處理完所有工作表後，重新排序
-    sheets = workbook.sheetnames
-    # 只對員工工作表進行排序，保留前兩個工作表不變
-    employee_sheets = sheets[2:]
+# 背景工作的各個階段
+BUILD_STAGES = {
+    'queued': "等待中",
+    'partition': "分配旅次",
+    'write': "寫入工作表",
+    'save': "儲存文件",
+}
 
-    # 根據工作表名稱（員工編號）進行排序
-    sorted_sheets = sorted(employee_sheets, key=lambda x: x.split()[0])
+# 背景工作進行中時更新進度的間隔（秒）
+BUILD_POLL_SECONDS = 0.5
 
-    # 重新排列工作表
-    for i, sheet_name in enumerate(sorted_sheets, start=2):
-        workbook.move_sheet(sheet_name, offset=i - workbook.index(workbook[sheet_name]))
 
-    # 将修改后的工作保存到内存中
-    output = io.BytesIO()
-    workbook.save(output)
-    output.seek(0)
+@st.fragment(run_every=BUILD_POLL_SECONDS)
+def show_build_progress(job):
+    # 完成後重新執行整個頁面，顯示下載按鈕並停止更新
+    if job['future'].done():
+        st.rerun()
 
-    return output
+    stage = BUILD_STAGES.get(job['stage'], job['stage'])
+    if job['total']:
+        st.progress(job['done'] / job['total'], text=f"{stage}：{job['done']}/{job['total']}")
+    else:
+        st.progress(0, text=f"{stage}...")
+
+
+# 效能分析紀錄的各個階段
+PROFILE_STAGES = {
+    'read_excel': "讀取Excel",
+    'process_dataframe': "擷取旅次明細",
+    'normalize': "轉換欄位型別",
+    'store_load': "讀取存放區",
+    'store_save': "寫入存放區",
+    'partition': "分配旅次",
+    'styles': "加入樣式",
+    'copy_original': "複製原始工作表",
+    'sheet': "產生工作表",
+    'reorder': "排列工作表",
+    'save': "儲存文件",
+}
+
+
+def profiled(records, func, *args):
+    # 開啟效能分析時，記錄 func 執行期間各階段的時間、行數與記憶體峰值
+    if records is None:
+        return func(*args)
+    with profiling(records):
+        return func(*args)
+
+
+def show_profile(placeholder, records):
+    if not records:
+        placeholder.caption("尚無紀錄。解析新的文件或產生輸出文件時會記錄各階段。")
+        return
+    placeholder.dataframe(
+        pd.DataFrame(
+            [
+                {
+                    '階段': "　" * record['depth']
+                    + PROFILE_STAGES.get(record['stage'], record['stage']),
+                    '工作表': record.get('title', ""),
+                    '行數': record['rows'],
+                    '時間（秒）': record['seconds'],
+                    '記憶體峰值（MB）': record['peak_mb'],
+                }
+                for record in ordered_records(records)
+            ]
+        ).astype({'行數': 'Int64'}),
+        hide_index=True,
+    )
 
 
-def get_all_employee_ids(df):
+def get_all_employee_ids(employee_index):
     employee_column = '員工編號'
-    if employee_column not in df.columns:
+    if employee_index is None:
         st.error(f"找不到 '{employee_column}' 列。請確保數據中包含此列。")
         return []
-    return sorted(df[employee_column].unique().tolist())
+    return employee_index['employee_ids']
 
 
 def main():
-    st.title("Excel數據整理工具")
-
-    # 上传Excel文件
-    uploaded_file = st.file_uploader("請上傳Excel文件", type=["xlsx", "xls"])
+    st.set_page_config(
+        page_title="台灣大車隊報表整理 App",
+        page_icon="🍁",
+        layout="wide",
+    )
 
-    if uploaded_file is not None:
-        # 獲取上傳文件的原始名稱
-        original_filename = uploaded_file.name
+    st.title("Excel數據整理工具")
 
-        # 讀取所有工作表
-        xls = pd.ExcelFile(uploaded_file)
-        sheet_names = xls.sheet_names
+    # 效能分析（選用）：紀錄保存在 session 中，背景工作完成後重新執行頁面時一併顯示
+    profile_records = None
+    with st.expander("效能分析"):
+        if st.toggle("記錄各階段的執行時間、處理行數與記憶體峰值", key='profiling'):
+            st.caption(
+                "記憶體追蹤由整個伺服器程序共用：開啟期間其他使用者的操作也會變慢；"
+                "多人同時記錄時，重疊階段的記憶體峰值無法區分，會留空。"
+            )
+            profile_records = st.session_state.setdefault('profile_records', [])
+            if st.button("清除紀錄"):
+                profile_records.clear()
+            profile_area = st.empty()
+            show_profile(profile_area, profile_records)
+
+    # 上传Excel文件（可一次上傳多份對帳單合併處理）
+    uploaded_files = st.file_uploader(
+        "請上傳Excel文件", type=["xlsx", "xls"], accept_multiple_files=True
+    )
 
-        # 讓用戶選擇工作表
-        selected_sheet = st.selectbox("請選擇要處理的工作表", sheet_names)
+    if uploaded_files:
+        # 每份文件選擇要處理的工作表，以（內容雜湊, 工作表）識別每份對帳單
+        sources = []
+        for uploaded_file in uploaded_files:
+            # 以內容雜湊快取解析結果，重新執行時不必再解析 Excel
+            file_bytes = uploaded_file.getvalue()
+            file_hash = file_digest(file_bytes)
+
+            # 讀取所有工作表
+            sheet_names = load_sheet_names(file_hash, file_bytes)
+
+            # 讓用戶選擇工作表
+            selected_sheets = st.multiselect(
+                f"請選擇 {uploaded_file.name} 要處理的工作表",
+                sheet_names,
+                default=sheet_names[:1],
+                key=f"sheets_{file_hash}",
+            )
+            for sheet_name in selected_sheets:
+                source = (file_hash, sheet_name)
+                if source not in [item['source'] for item in sources]:
+                    sources.append(
+                        {'source': source, 'name': uploaded_file.name, 'file_bytes': file_bytes}
+                    )
+
+        if not sources:
+            return
+
+        if len(sources) == 1:
+            # 單一對帳單：輸出時沿用原始工作簿
+            file_hash, selected_sheet = sources[0]['source']
+            file_bytes = sources[0]['file_bytes']
+            original_filename = sources[0]['name']
+
+            # 顯示原始數據（需要時才解析整個工作表，已存放過的檔案可直接讀取整理後的資料）
+            if st.toggle("顯示原始數據"):
+                df = load_sheet(file_hash, selected_sheet, file_bytes)
+                st.subheader(f"原始數據 - {selected_sheet}")
+                show_preview(df, 'raw', (file_hash, selected_sheet, 'raw'))
+
+            # 處理數據
+            processed_df, billing_period, memory_usage = profiled(
+                profile_records, load_processed_sheet, file_hash, selected_sheet, file_bytes
+            )
 
-        # 讀取選定的工作表
-        df = pd.read_excel(uploaded_file, sheet_name=selected_sheet, header=None)
+            # 顯示處理後的數據
+            st.subheader(f"處理後的數據 - {selected_sheet}")
+            show_preview(processed_df, 'processed', (file_hash, selected_sheet, 'processed'))
+            st.caption(
+                f"欄位型別轉換後記憶體用量：{memory_usage['before'] / 1024 ** 2:.2f} MB → "
+                f"{memory_usage['after'] / 1024 ** 2:.2f} MB"
+            )
+            employee_index = load_employee_index(file_hash, selected_sheet, processed_df)
+            original_bytes = file_bytes
+            download_filename = original_filename.replace('.xlsx', '_更新.xlsx')
+        else:
+            # 多份對帳單：只讀入新加入的對帳單，已合併的資料保留在 session 中
+            consolidation = st.session_state.get('consolidation')
+            selected = [item['source'] for item in sources]
+            if consolidation is None or any(
+                ingested['source'] not in selected for ingested in consolidation['sources']
+            ):
+                # 有對帳單被移除時，依目前的選擇重新合併（各對帳單的解析結果仍在快取中）
+                consolidation = new_consolidation()
+
+            ingested_sources = [ingested['source'] for ingested in consolidation['sources']]
+            for item in sources:
+                if item['source'] in ingested_sources:
+                    continue
+                file_hash, sheet_name = item['source']
+                df, period, _ = profiled(
+                    profile_records, load_processed_sheet, file_hash, sheet_name, item['file_bytes']
+                )
+                if '員工編號' not in df.columns or '員工姓名' not in df.columns:
+                    st.warning(f"{item['name']} - {sheet_name} 中找不到旅次明細，已略過。")
+                    continue
+                ingest_statement(
+                    consolidation, item['source'], f"{item['name']} - {sheet_name}", df, period
+                )
+            st.session_state['consolidation'] = consolidation
 
-        # 顯示原始數據
-        st.subheader(f"原始數據 - {selected_sheet}")
-        st.dataframe(df)
+            processed_df = consolidation['trips']
+            if processed_df is None:
+                return
+            billing_period = combine_billing_periods(
+                [ingested['billing_period'] for ingested in consolidation['sources']]
+            )
 
-        # 處理數據
-        processed_df, billing_period = process_dataframe(df)
+            # 顯示合併後的數據
+            st.subheader("合併後的數據")
+            st.dataframe(
+                pd.DataFrame(
+                    [
+                        {
+                            '對帳單': ingested['label'],
+                            '列帳期間': ingested['billing_period'],
+                            '旅次筆數': ingested['rows'],
+                            '新增筆數': ingested['added'],
+                        }
+                        for ingested in consolidation['sources']
+                    ]
+                ),
+                hide_index=True,
+            )
+            st.caption(f"合併後列帳期間：{billing_period}，共 {len(processed_df)} 筆旅次")
+            show_preview(
+                processed_df,
+                'merged',
+                (tuple(ingested['source'] for ingested in consolidation['sources']), 'merged'),
+            )
+            if consolidation['employee_index'] is None:
+                consolidation['employee_index'] = build_employee_index(processed_df)
+            employee_index = consolidation['employee_index']
+            original_bytes = None
+            download_filename = '合併對帳單_更新.xlsx'
 
-        # 顯示處理後的數據
-        st.subheader(f"處理後的數據 - {selected_sheet}")
-        st.dataframe(processed_df)
+        # 加入本次解析的紀錄
+        if profile_records is not None:
+            show_profile(profile_area, profile_records)
 
         # 顯示每個員工的數據
-        display_employee_data(processed_df)
+        display_employee_data(processed_df, employee_index)
 
         # 获取所有员工编号
-        all_employee_ids = get_all_employee_ids(processed_df)
+        all_employee_ids = get_all_employee_ids(employee_index)
 
         # 添加输入框让用户输入员工编号和分机的对应关系
         default_extension_input = "08956: 6312\n07030: 6412\n05259: 2340\n06294: 8254\n08332: 6654\n09025: 6716\n09092: 6112\n09137: 6834\n09214: 5738\n09324: 2531\n07468: 6417\n08951: 6300\n09021: 6413\n09335: 6416"
@@ -511,26 +545,58 @@ def main():
         )
 
         # 處理用戶輸入的分組信息
-        grouped_employees = {}
-        if grouped_employees_input.strip():  # 只有當輸入不為空時才處理
-            for i, group in enumerate(grouped_employees_input.split('\n')):
-                employees = [emp.strip() for emp in group.split(',') if emp.strip()]
-                if employees:
-                    grouped_employees[f'Group_{i+1}'] = employees
-
-        # 創建包含每個員工數據的Excel文件
-        output = create_employee_sheets(
-            processed_df, billing_period, uploaded_file, grouped_employees, extension
-        )
+        grouped_employees = parse_group_input(grouped_employees_input)
+
+        output_mode = st.radio("輸出方式", [WORKBOOK_OUTPUT, ARCHIVE_OUTPUT], horizontal=True)
 
-        if output:
-            # 提供下载按钮，使用原始文件名
-            st.download_button(
-                label="下載修改後的Excel文件",
-                data=output.getvalue(),
-                file_name=original_filename.replace('.xlsx', '_更新.xlsx'),
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        # 輸出檔案只在使用者要求時才產生，輸入改變後需重新要求
+        report_key = report_cache_key(
+            [ingested['source'] for ingested in sources], grouped_employees, extension, output_mode
+        )
+        if st.button("產生Excel文件"):
+            st.session_state['report_key'] = report_key
+
+        if st.session_state.get('report_key') == report_key:
+            # 在背景產生包含每個員工數據的Excel文件；相同輸入的工作（含其他使用者送出的）直接沿用
+            job = submit_job(
+                report_key,
+                lambda progress: profiled(
+                    profile_records,
+                    build_report,
+                    report_key,
+                    processed_df,
+                    billing_period,
+                    original_bytes,
+                    progress,
+                ),
             )
+            if not job['future'].done():
+                show_build_progress(job)
+                return
+
+            if job['future'].exception() is not None:
+                st.error(f"產生文件時發生錯誤：{job['future'].exception()}")
+                del st.session_state['report_key']
+                return
+
+            output = job['future'].result()
+            if output is None:
+                st.error("找不到 '員工編號' 或 '員工姓名' 列。請確保數據中包含這些列。")
+            elif output_mode == ARCHIVE_OUTPUT:
+                st.download_button(
+                    label="下載各員工的Excel文件（ZIP）",
+                    data=output,
+                    file_name=download_filename.replace('.xlsx', '.zip'),
+                    mime="application/zip",
+                )
+            else:
+                # 提供下载按钮，使用原始文件名
+                st.download_button(
+                    label="下載修改後的Excel文件",
+                    data=output,
+                    file_name=download_filename,
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                )
 
 
 if __name__ == "__main__":
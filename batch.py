@@ -0,0 +1,230 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import io
+import json
+import os
+from pathlib import Path
+import sys
+import tempfile
+from time import perf_counter
+import pandas as pd
+from profiling import ordered_records, profiling
+import report_writer
+from statement_pipeline import (
+    create_employee_archive,
+    create_employee_sheets,
+    file_digest,
+    load_statement_or_parse,
+    parse_extension_input,
+    parse_group_input,
+)
+
+OUTPUT_SUFFIX = '_更新'
+
+
+def output_path_for(input_path, output_dir):
+    return Path(output_dir) / f"{input_path.stem}{OUTPUT_SUFFIX}{input_path.suffix}"
+
+
+def find_statements(input_dir):
+    # 略過先前產生的輸出檔以及 Excel 開啟檔案時留下的暫存檔
+    return sorted(
+        path
+        for path in Path(input_dir).glob('*.xlsx')
+        if not path.stem.endswith(OUTPUT_SUFFIX) and not path.name.startswith('~$')
+    )
+
+
+def _init_worker():
+    # 批次模式已按檔案平行處理，每個檔案內的工作表不再另開行程池
+    report_writer.SHEET_WORKERS = 1
+
+
+def process_statement(
+    input_path,
+    output_path,
+    sheet_name,
+    grouped_employees,
+    extension,
+    per_employee=False,
+    profile=False,
+):
+    # 開啟效能分析時，各階段的紀錄隨結果一併回傳
+    if not profile:
+        return _process_statement(
+            input_path, output_path, sheet_name, grouped_employees, extension, per_employee
+        )
+    records = []
+    with profiling(records):
+        result = _process_statement(
+            input_path, output_path, sheet_name, grouped_employees, extension, per_employee
+        )
+    result['profile'] = ordered_records(records)
+    return result
+
+
+def _write_output(output_path, write):
+    # 先寫入同一資料夾的暫存檔，完成後才換成輸出檔名；產生失敗時不留下不完整的輸出檔
+    temp = tempfile.NamedTemporaryFile(
+        'w+b', dir=output_path.parent, prefix=f"{output_path.stem}.", suffix='.tmp', delete=False
+    )
+    try:
+        with temp:
+            output = write(temp)
+        if output is not None:
+            os.replace(temp.name, output_path)
+    finally:
+        if os.path.exists(temp.name):
+            os.unlink(temp.name)
+    return output
+
+
+def _process_statement(
+    input_path, output_path, sheet_name, grouped_employees, extension, per_employee
+):
+    started = perf_counter()
+    result = {'file': input_path.name, 'output': None, 'sheet': None, 'rows': 0, 'employees': 0}
+
+    file_bytes = input_path.read_bytes()
+    file_hash = file_digest(file_bytes)
+
+    sheet_names = pd.ExcelFile(io.BytesIO(file_bytes)).sheet_names
+    if sheet_name is None:
+        sheet_name = sheet_names[0]
+    elif sheet_name not in sheet_names:
+        result['error'] = f"找不到工作表 '{sheet_name}'"
+        result['seconds'] = round(perf_counter() - started, 3)
+        return result
+    result['sheet'] = sheet_name
+
+    processed_df, billing_period, memory_usage, stored = load_statement_or_parse(
+        file_bytes, file_hash, sheet_name
+    )
+    result['stored'] = stored
+    result['memory_before'] = memory_usage['before']
+    result['memory_after'] = memory_usage['after']
+    parsed = perf_counter()
+
+    # 直接寫入輸出檔，不在記憶體中保留整個檔案
+    if per_employee:
+        # 各員工的工作簿完成一個寫入一個
+        output_path = output_path.with_suffix('.zip')
+        output = _write_output(
+            output_path,
+            lambda archive: create_employee_archive(
+                processed_df, billing_period, grouped_employees, extension, archive
+            ),
+        )
+    else:
+        output = _write_output(
+            output_path,
+            lambda workbook: create_employee_sheets(
+                processed_df, billing_period, input_path, grouped_employees, extension, workbook
+            ),
+        )
+
+    if output is None:
+        result['error'] = "找不到 '員工編號' 或 '員工姓名' 列"
+    else:
+        result['output'] = output_path.name
+        result['rows'] = len(processed_df)
+        result['employees'] = processed_df['員工編號'].nunique()
+
+    result['parse_seconds'] = round(parsed - started, 3)
+    result['seconds'] = round(perf_counter() - started, 3)
+    return result
+
+
+def _read_text(path):
+    return Path(path).read_text(encoding='utf-8') if path else ''
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批次整理資料夾內的台灣大車隊月結報表")
+    parser.add_argument('input_dir', help="存放 xlsx 報表的資料夾")
+    parser.add_argument('-o', '--output-dir', help="輸出資料夾（預設與輸入相同）")
+    parser.add_argument('--sheet', help="要處理的工作表名稱（預設為第一個工作表）")
+    parser.add_argument('--extensions', help="員工編號與分機的對應檔（每行 '員工編號: 分機'）")
+    parser.add_argument('--groups', help="員工分組檔（每組一行，用逗號分隔）")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="平行處理的行程數")
+    parser.add_argument(
+        '--per-employee', action='store_true', help="每位員工各輸出一個 Excel 文件，打包為 ZIP"
+    )
+    parser.add_argument('--report', help="將每個檔案的處理結果以 JSON lines 寫入此檔")
+    parser.add_argument(
+        '--profile', help="將每個檔案各階段的執行時間、行數與記憶體峰值以 JSON lines 寫入此檔"
+    )
+    args = parser.parse_args(argv)
+
+    statements = find_statements(args.input_dir)
+    if not statements:
+        print(f"{args.input_dir} 中沒有 xlsx 檔案", file=sys.stderr)
+        return 1
+
+    output_dir = Path(args.output_dir or args.input_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    extension = parse_extension_input(_read_text(args.extensions))
+    grouped_employees = parse_group_input(_read_text(args.groups))
+
+    started = perf_counter()
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(args.workers, len(statements))),
+        mp_context=report_writer.process_context(preload=['statement_pipeline']),
+        initializer=_init_worker,
+    ) as executor:
+        futures = {
+            executor.submit(
+                process_statement,
+                path,
+                output_path_for(path, output_dir),
+                args.sheet,
+                grouped_employees,
+                extension,
+                args.per_employee,
+                bool(args.profile),
+            ): path
+            for path in statements
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as error:
+                result = {
+                    'file': path.name,
+                    'output': None,
+                    'error': f"{type(error).__name__}: {error}",
+                }
+            results.append(result)
+
+            if 'error' in result:
+                print(f"✗ {result['file']}: {result['error']}", file=sys.stderr)
+            else:
+                print(
+                    f"✓ {result['file']} -> {result['output']}"
+                    f"（{result['rows']} 筆旅次，{result['employees']} 位員工，{result['seconds']:.2f} 秒）"
+                )
+
+    results.sort(key=lambda result: result['file'])
+    if args.profile:
+        with open(args.profile, 'w', encoding='utf-8') as profile:
+            for result in results:
+                for record in result.pop('profile', []):
+                    profile.write(
+                        json.dumps({'file': result['file'], **record}, ensure_ascii=False) + '\n'
+                    )
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as report:
+            for result in results:
+                report.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    failed = sum('error' in result for result in results)
+    print(
+        f"完成 {len(results) - failed}/{len(results)} 個檔案，共 {perf_counter() - started:.2f} 秒"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,341 @@
+import argparse
+from datetime import date, datetime, timedelta
+import io
+import json
+import os
+from pathlib import Path
+import platform
+import random
+import statistics
+import sys
+from time import perf_counter
+from openpyxl import Workbook
+import pandas as pd
+import report_writer
+from statement_pipeline import (
+    create_employee_sheets,
+    find_statement_markers,
+    normalize_trip_columns,
+    process_dataframe,
+)
+
+# 預設的測試規模：（旅次筆數, 員工數）
+DEFAULT_SIZES = '1000x10,10000x500,100000x5000'
+
+# 比對基準時，慢於基準超過此比例即視為退步
+DEFAULT_TOLERANCE = 0.2
+
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+TRIP_COLUMNS = [
+    '序號',
+    '乘車時間',
+    '員工編號',
+    '員工姓名',
+    '上車地點',
+    '下車地點',
+    '車資',
+    '折扣後車資',
+]
+
+SURNAMES = '陳林黃張李王吳劉蔡楊許鄭謝洪郭邱曾廖賴徐周葉蘇莊呂江何蕭羅高潘簡朱鍾彭游詹胡施沈余盧梁趙顏柯翁魏孫戴'
+GIVEN_NAMES = (
+    '志明俊傑建宏家豪承恩冠宇宗翰雅婷怡君淑芬美玲佳穎詩涵欣怡宜蓁郁婷思妤雅雯柏翰彥廷品妍子晴'
+)
+
+LOCATIONS = [
+    '台北市內湖區瑞光路513巷',
+    '台北市內湖區新湖二路',
+    '台北市信義區市府路45號',
+    '台北市中正區北平西路3號',
+    '台北市松山區敦化北路340之9號',
+    '台北市大安區忠孝東路四段',
+    '台北市中山區南京東路二段',
+    '新北市板橋區縣民大道二段7號',
+    '新北市汐止區新台五路一段',
+    '新北市新店區北新路三段',
+    '桃園市大園區航站南路9號',
+    '桃園市中壢區中北路',
+    '新竹市東區光復路二段',
+    '新竹縣竹北市高鐵七路6號',
+    '基隆市仁愛區港西街',
+]
+
+
+def statement_period(start=date(2024, 8, 1)):
+    # 列帳期間為一個月
+    end = (start.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    return start, end
+
+
+def generate_employees(count, rng):
+    ids = rng.sample(range(1000, 100000), count)
+    return [
+        (f'{employee_id:05d}', rng.choice(SURNAMES) + ''.join(rng.sample(GIVEN_NAMES, 2)))
+        for employee_id in ids
+    ]
+
+
+def generate_trips(trips, employees, rng, period):
+    # 搭乘次數集中在少數員工，車資以跳表起價加上里程計費的方式產生
+    start, end = period
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(len(employees))]
+    riders = rng.choices(employees, weights=weights, k=trips)
+    minutes = (end - start).days * 24 * 60 + 24 * 60
+
+    rows = []
+    for idx, (employee_id, employee_name) in enumerate(riders, start=1):
+        ride_time = datetime.combine(start, datetime.min.time()) + timedelta(
+            minutes=rng.randrange(minutes)
+        )
+        pickup, dropoff = rng.sample(LOCATIONS, 2)
+        fare = 85 + 5 * int(rng.lognormvariate(3.3, 0.8))
+        rows.append(
+            [
+                idx,
+                ride_time.strftime('%Y/%m/%d %H:%M'),
+                employee_id,
+                employee_name,
+                pickup,
+                dropoff,
+                fare,
+                int(round(fare * 0.95)),
+            ]
+        )
+    rows.sort(key=lambda row: row[1])
+    for idx, row in enumerate(rows, start=1):
+        row[0] = idx
+    return rows
+
+
+def generate_statement(trips, employees, seed=0, output=None):
+    # 產生台灣大車隊月結對帳單格式的 xlsx：前言、列帳期間、旅次明細表與總共列
+    rng = random.Random(seed)
+    period = statement_period()
+    employee_rows = generate_employees(min(employees, trips), rng)
+    rows = generate_trips(trips, employee_rows, rng, period)
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('對帳單')
+    worksheet.append(['企業會員乘車服務電子對帳單'])
+    worksheet.append(['客戶名稱：', '範例科技股份有限公司'])
+    worksheet.append(['統一編號：', '12345678'])
+    worksheet.append(
+        [
+            '列帳期間：',
+            f"{period[0]:%Y 年 %m 月 %d 日} ~ {period[1]:%Y 年 %m 月 %d 日}",
+        ]
+    )
+    worksheet.append([])
+    worksheet.append(['旅次明細表'])
+    worksheet.append(TRIP_COLUMNS)
+    for row in rows:
+        worksheet.append(row)
+    worksheet.append(['總共：', len(rows), None, None, None, None, None, sum(r[7] for r in rows)])
+
+    # 對帳單另有一個繳費資訊的工作表，輸出時會保留在員工工作表之前
+    info = workbook.create_sheet('繳費資訊')
+    info.append(['繳費期限：', f"{period[1] + timedelta(days=25):%Y/%m/%d}"])
+    info.append(['應繳金額：', sum(r[7] for r in rows)])
+
+    if output is None:
+        output = io.BytesIO()
+    workbook.save(output)
+    return output
+
+
+def parse_sizes(text):
+    sizes = []
+    for item in text.split(','):
+        trips, employees = item.strip().lower().split('x')
+        sizes.append((int(trips), int(employees)))
+    return sizes
+
+
+def benchmark_groups(employee_ids, size=5, fraction=0.1):
+    # 取約一成的員工，每 size 人合併為一個分組
+    members = sorted(employee_ids)[: max(size, int(len(employee_ids) * fraction))]
+    return {
+        f"第{idx + 1}組": members[start : start + size]
+        for idx, start in enumerate(range(0, len(members), size))
+    }
+
+
+def measure(func, repeat):
+    # 每次執行前清除工作表快取，量測的是完整產生的時間
+    times = []
+    for _ in range(repeat):
+        report_writer.clear_sheet_cache()
+        started = perf_counter()
+        func()
+        times.append(perf_counter() - started)
+    return {'min': round(min(times), 4), 'median': round(statistics.median(times), 4)}
+
+
+def legacy_statement_markers(df):
+    # 向量化之前的標記搜尋：逐行轉為字串比對兩次，再以 iterrows 找列帳期間，作為比較的基準
+    start_row = df[df.apply(lambda row: '旅次明細表' in str(row.values), axis=1)].index
+    end_row = df[df.apply(lambda row: str(row.values[0]).startswith('總共：'), axis=1)].index
+
+    billing_period = ''
+    for _, row in df.iterrows():
+        if '列帳期間：' in str(row.values):
+            billing_period = row.values[1]
+            break
+
+    header_row = start_row[0] + 1 if len(start_row) > 0 else None
+    end_row = end_row[0] if len(end_row) > 0 else None
+    return header_row, end_row, billing_period
+
+
+def upload_to_bytes(statement_bytes, grouped_employees):
+    # 與網頁上傳後相同的流程：讀取、擷取明細、轉換型別、產生輸出並讀出內容
+    df = pd.read_excel(io.BytesIO(statement_bytes), sheet_name='對帳單', header=None)
+    processed_df, billing_period = process_dataframe(df)
+    processed_df, _ = normalize_trip_columns(processed_df)
+    output = create_employee_sheets(
+        processed_df, billing_period, io.BytesIO(statement_bytes), grouped_employees, {}
+    )
+    with output:
+        return output.read()
+
+
+def run_size(trips, employees, repeat, seed=0):
+    statement_bytes = generate_statement(trips, employees, seed).getvalue()
+    raw_df = pd.read_excel(io.BytesIO(statement_bytes), sheet_name='對帳單', header=None)
+    processed_df, billing_period = process_dataframe(raw_df)
+    processed_df, _ = normalize_trip_columns(processed_df)
+    groups = benchmark_groups(processed_df['員工編號'].unique().tolist())
+    if find_statement_markers(raw_df) != legacy_statement_markers(raw_df):
+        raise AssertionError("find_statement_markers 與舊的標記搜尋結果不同")
+
+    def create_sheets(grouped_employees):
+        output = create_employee_sheets(
+            processed_df, billing_period, io.BytesIO(statement_bytes), grouped_employees, {}
+        )
+        output.close()
+
+    cases = {
+        'find_statement_markers': lambda: find_statement_markers(raw_df),
+        'find_statement_markers_legacy': lambda: legacy_statement_markers(raw_df),
+        'process_dataframe': lambda: process_dataframe(raw_df),
+        'create_employee_sheets': lambda: create_sheets({}),
+        'create_employee_sheets_grouped': lambda: create_sheets(groups),
+        'upload_to_bytes': lambda: upload_to_bytes(statement_bytes, {}),
+    }
+
+    results = []
+    for name, func in cases.items():
+        timing = measure(func, repeat)
+        results.append(
+            {
+                'benchmark': name,
+                'trips': trips,
+                'employees': processed_df['員工編號'].nunique(),
+                **timing,
+            }
+        )
+        print(
+            f"{name:<32} {trips:>7} 筆 {results[-1]['employees']:>5} 人 "
+            f"{timing['min']:>9.3f} 秒（中位數 {timing['median']:.3f}）",
+            flush=True,
+        )
+    return results
+
+
+def result_key(result):
+    return f"{result['benchmark']}/{result['trips']}x{result['employees']}"
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'pandas': pd.__version__,
+    }
+
+
+def compare_results(results, baseline, tolerance):
+    # 以最短時間與基準比較，回傳退步的項目
+    if baseline['machine'] != machine_info():
+        print("注意：基準是在不同的環境下量測的，比較結果僅供參考", file=sys.stderr)
+
+    previous = {result_key(result): result for result in baseline['results']}
+    regressions = []
+    print(f"\n{'項目':<44} {'基準':>9} {'本次':>9} {'比例':>7}")
+    for result in results:
+        key = result_key(result)
+        if key not in previous:
+            print(f"{key:<46} {'-':>9} {result['min']:>9.3f} {'（新項目）':>7}")
+            continue
+        ratio = result['min'] / previous[key]['min'] if previous[key]['min'] else float('inf')
+        mark = ''
+        if ratio > 1 + tolerance:
+            mark = ' 退步'
+            regressions.append(key)
+        elif ratio < 1 - tolerance:
+            mark = ' 進步'
+        print(f"{key:<46} {previous[key]['min']:>9.3f} {result['min']:>9.3f} {ratio:>7.2f}{mark}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="報表整理流程的合成資料產生器與效能測試")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help="產生一份合成的月結對帳單")
+    generate.add_argument('output', help="輸出的 xlsx 路徑")
+    generate.add_argument('--trips', type=int, default=1000, help="旅次筆數")
+    generate.add_argument('--employees', type=int, default=50, help="員工數")
+    generate.add_argument('--seed', type=int, default=0, help="亂數種子")
+
+    run = commands.add_parser('run', help="執行效能測試並與基準比較")
+    run.add_argument(
+        '--sizes', default=DEFAULT_SIZES, help="測試規模，格式為 '旅次筆數x員工數'，以逗號分隔"
+    )
+    run.add_argument('--repeat', type=int, default=3, help="每個項目的重複次數（取最短時間）")
+    run.add_argument('--baseline', default=DEFAULT_BASELINE, help="基準結果的 JSON 檔")
+    run.add_argument('--save-baseline', action='store_true', help="將本次結果存為新的基準")
+    run.add_argument(
+        '--tolerance', type=float, default=DEFAULT_TOLERANCE, help="慢於基準超過此比例時視為退步"
+    )
+    run.add_argument('--output', help="將本次結果以 JSON 寫入此檔")
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        with open(args.output, 'wb') as output:
+            generate_statement(args.trips, args.employees, args.seed, output)
+        return 0
+
+    results = []
+    for trips, employees in parse_sizes(args.sizes):
+        results.extend(run_size(trips, employees, max(1, args.repeat)))
+
+    current = {'machine': machine_info(), 'results': results}
+    if args.output:
+        Path(args.output).write_text(
+            json.dumps(current, ensure_ascii=False, indent=2), encoding='utf-8'
+        )
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.write_text(
+            json.dumps(current, ensure_ascii=False, indent=2), encoding='utf-8'
+        )
+        print(f"\n已將結果存為基準：{baseline_path}")
+        return 0
+    if not baseline_path.exists():
+        print(f"\n找不到基準 {baseline_path}，可加上 --save-baseline 建立")
+        return 0
+
+    baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+    regressions = compare_results(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} 個項目慢於基準超過 {args.tolerance:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+# 同時在背景產生報表的工作數
+BUILD_WORKERS = 2
+
+# 保留已完成工作（含產生的檔案）的數量，超過時移除最早完成的工作
+FINISHED_JOBS_MAX = 8
+
+# 已完成工作保留的檔案總大小上限（位元組），超過時同樣移除最早完成的工作；最新完成的工作一律保留
+FINISHED_JOBS_MAX_BYTES = 256 * 1024 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=BUILD_WORKERS, thread_name_prefix='report-build')
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def submit_job(key, build):
+    # 相同輸入的工作只執行一次：進行中或已完成的工作直接沿用，失敗的工作才重新送出
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is not None and not (job['future'].done() and job['future'].exception()):
+            return job
+
+        job = {'key': key, 'stage': 'queued', 'done': 0, 'total': 0}
+
+        def progress(stage, done=0, total=0):
+            job.update(stage=stage, done=done, total=total)
+
+        job['future'] = _executor.submit(build, progress)
+        _jobs[key] = job
+        _evict_finished_jobs()
+        return job
+
+
+def _result_size(job):
+    future = job['future']
+    if future.exception() is not None or future.result() is None:
+        return 0
+    return len(future.result())
+
+
+def _evict_finished_jobs():
+    finished = [key for key, job in _jobs.items() if job['future'].done()]
+    total = sum(_result_size(_jobs[key]) for key in finished)
+    for idx, key in enumerate(finished[:-1]):
+        if len(finished) - idx <= FINISHED_JOBS_MAX and total <= FINISHED_JOBS_MAX_BYTES:
+            break
+        total -= _result_size(_jobs.pop(key))
@@ -0,0 +1,87 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+from time import perf_counter
+import tracemalloc
+
+# 目前作用中的效能紀錄（依執行緒／context 各自獨立）
+_active = ContextVar('profiling', default=None)
+
+# 有任何紀錄作用中時才啟用 tracemalloc，最後一個結束時停止
+# tracemalloc 是整個程序共用的：追蹤期間同一程序中的其他 session 也會一併變慢，
+# 峰值也無法區分來源，因此多個紀錄同時作用時記憶體峰值記為 None
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_entries = 0
+_started_tracing = False
+
+
+@contextmanager
+def profiling(records):
+    # 區塊內執行的 profile_stage 都會把結果加入 records
+    global _tracing_users, _tracing_entries, _started_tracing
+
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _tracing_users += 1
+        _tracing_entries += 1
+
+    token = _active.set({'records': records, 'stack': [], 'started': perf_counter()})
+    try:
+        yield records
+    finally:
+        _active.reset(token)
+        with _tracing_lock:
+            _tracing_users -= 1
+            if _tracing_users == 0 and _started_tracing:
+                tracemalloc.stop()
+                _started_tracing = False
+
+
+@contextmanager
+def profile_stage(stage, rows=None, **fields):
+    # 記錄一個階段的執行時間、處理行數與記憶體峰值；沒有作用中的紀錄時不做任何事
+    state = _active.get()
+    if state is None:
+        yield {}
+        return
+
+    record = {'stage': stage, 'rows': rows, **fields}
+    stack = state['stack']
+
+    # 階段開始時已有其他紀錄作用中，或期間有新的紀錄開始，峰值就會互相干擾
+    with _tracing_lock:
+        shared = _tracing_users > 1
+        entries = _tracing_entries
+
+    # 重設峰值前先保留外層階段到目前為止的峰值
+    outer_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    stack.append(record)
+    started = perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = perf_counter() - started
+        peak = max(tracemalloc.get_traced_memory()[1], record.pop('_inner_peak', 0))
+        with _tracing_lock:
+            shared = shared or _tracing_users > 1 or _tracing_entries != entries
+        shared = record.pop('_shared', False) or shared
+        stack.pop()
+        if stack:
+            stack[-1]['_inner_peak'] = max(stack[-1].get('_inner_peak', 0), outer_peak, peak)
+            # 內層階段的峰值不可靠時，外層階段的峰值也不可靠
+            stack[-1]['_shared'] = stack[-1].get('_shared', False) or shared
+
+        record['depth'] = len(stack)
+        record['offset'] = round(started - state['started'], 4)
+        record['seconds'] = round(seconds, 4)
+        record['peak_mb'] = None if shared else round(peak / 1024**2, 2)
+        state['records'].append(record)
+
+
+def ordered_records(records):
+    # 紀錄在階段結束時加入，依開始時間排序後外層階段會排在內層之前
+    return sorted(records, key=lambda record: (record['offset'], record['depth']))
@@ -0,0 +1,888 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from copy import copy
+from datetime import date, datetime, time, timedelta
+import hashlib
+import html
+import io
+import multiprocessing
+import os
+import posixpath
+import re
+import shutil
+import struct
+import threading
+from xml.sax.saxutils import escape
+import zipfile
+from cachetools import LRUCache
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.datetime import to_excel
+from openpyxl.workbook.child import INVALID_TITLE_REGEX, avoid_duplicate_name
+from openpyxl.xml.functions import tostring
+from openpyxl.styles import Font, Alignment, Border, NamedStyle, Side
+from openpyxl.styles.fonts import DEFAULT_FONT
+from profiling import profile_stage
+
+
+def column_widths(columns, max_lengths):
+    widths = []
+    for column, max_length in zip(columns, max_lengths):
+        if column in ['上車地點', '下車地點']:
+            widths.append(12)
+        else:
+            widths.append(max(max_length + 4, len(str(column)) + 6))
+    return widths
+
+
+THIN_BORDER = Border(
+    left=Side(style='thin'),
+    right=Side(style='thin'),
+    top=Side(style='thin'),
+    bottom=Side(style='thin'),
+)
+
+# 報表使用的具名樣式，儲存格以名稱引用，不再逐格建立 Font/Border/Alignment
+BODY_STYLE = '報表內文'
+BODY_UNBORDERED_STYLE = '報表內文（無框線）'
+TOTAL_STYLE = '報表合計'
+TOTAL_UNBORDERED_STYLE = '報表合計（無框線）'
+BORDERED_STYLE = '報表框線'
+TITLE_STYLE = '報表標題'
+HEADER_STYLE = '報表置中'
+LABEL_STYLE = '報表欄名'
+VALUE_STYLE = '報表欄值'
+
+REPORT_STYLES = {
+    BODY_STYLE: dict(font=Font(size=12), border=THIN_BORDER),
+    BODY_UNBORDERED_STYLE: dict(font=Font(size=12)),
+    TOTAL_STYLE: dict(font=Font(size=12, bold=True), border=THIN_BORDER),
+    TOTAL_UNBORDERED_STYLE: dict(font=Font(size=12, bold=True)),
+    BORDERED_STYLE: dict(font=DEFAULT_FONT, border=THIN_BORDER),
+    TITLE_STYLE: dict(
+        font=Font(size=12, bold=True),
+        border=THIN_BORDER,
+        alignment=Alignment(horizontal='center', vertical='center'),
+    ),
+    HEADER_STYLE: dict(
+        font=Font(size=12),
+        border=THIN_BORDER,
+        alignment=Alignment(horizontal='center', vertical='center'),
+    ),
+    LABEL_STYLE: dict(
+        font=Font(size=12),
+        border=THIN_BORDER,
+        alignment=Alignment(horizontal='right', vertical='center'),
+    ),
+    VALUE_STYLE: dict(
+        font=Font(size=12),
+        border=THIN_BORDER,
+        alignment=Alignment(horizontal='left', vertical='center'),
+    ),
+}
+
+
+def register_report_styles(workbook):
+    for name, attributes in REPORT_STYLES.items():
+        workbook.add_named_style(NamedStyle(name=name, **attributes))
+
+
+# 寫入日期、時間時使用的數字格式（與 openpyxl 預設相同）
+DATE_FORMATS = {
+    'datetime': 'yyyy-mm-dd h:mm:ss',
+    'date': 'yyyy-mm-dd',
+    'time': 'h:mm:ss',
+}
+
+RELATIONSHIPS_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+WORKSHEET_REL_TYPE = f'{RELATIONSHIPS_NS}/worksheet'
+WORKSHEET_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+
+# 平行產生工作表 XML 的行程數，以及值得啟用行程池的最少工作表數
+SHEET_WORKERS = os.cpu_count() or 1
+PARALLEL_MIN_SHEETS = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# 已產生的員工工作表 XML 快取（以位元組數為上限，超過時淘汰最久未使用的項目）
+SHEET_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_sheet_cache = LRUCache(maxsize=SHEET_CACHE_MAX_BYTES, getsizeof=len)
+_sheet_cache_lock = threading.Lock()
+
+
+def ignore_progress(stage, done=0, total=0):
+    # 進度回報的預設值：stage 為目前階段，done/total 為已完成與全部的工作表數
+    pass
+
+
+def _styled_cell(worksheet, value, style=None):
+    cell = WriteOnlyCell(worksheet)
+    # 先套用樣式再寫入數值，保留日期等數值自動設定的格式
+    if style is not None:
+        cell.style = style
+    cell.value = None if pd.isna(value) else value
+    return cell
+
+
+def copy_original_sheets(workbook, original_file):
+    # 將原始工作簿的工作表（數值、格式、合併儲存格、欄寬列高）複製到輸出工作簿
+    original = load_workbook(original_file)
+
+    for source in original.worksheets:
+        target = workbook.create_sheet(source.title)
+        target.freeze_panes = source.freeze_panes
+
+        # 欄寬、列高與合併儲存格須在寫入資料前設定
+        for key, dimension in source.column_dimensions.items():
+            if dimension.width:
+                target.column_dimensions[key].width = dimension.width
+        for key, dimension in source.row_dimensions.items():
+            if dimension.height:
+                target.row_dimensions[key].height = dimension.height
+        for merged_range in source.merged_cells.ranges:
+            target.merged_cells.add(merged_range.coord)
+
+        for row in source.iter_rows():
+            cells = []
+            for cell in row:
+                new_cell = WriteOnlyCell(target, value=cell.value)
+                if cell.has_style:
+                    new_cell.font = copy(cell.font)
+                    new_cell.border = copy(cell.border)
+                    new_cell.fill = copy(cell.fill)
+                    new_cell.number_format = cell.number_format
+                    new_cell.protection = copy(cell.protection)
+                    new_cell.alignment = copy(cell.alignment)
+                cells.append(new_cell)
+            target.append(cells)
+
+
+def summary_sheet_layout(summary_data, billing_period):
+    end_date_str = billing_period.split('~')[1].strip()
+    end_date = datetime.strptime(end_date_str, "%Y 年 %m 月 %d 日")
+
+    current_year_month = end_date.strftime("%Y/%m")
+    today = (end_date + timedelta(days=1)).strftime("%Y/%m/%d")
+
+    fixed_rows = [
+        ['台灣大車隊乘車費總表', None, None, current_year_month],
+        ['列帳期間：', None, None, billing_period],
+        ['收據日期', None, None, today],
+    ]
+
+    # 计算总计
+    total_count = sum(row[4] for row in summary_data)
+    total_amount = sum(row[5] for row in summary_data)
+
+    rows = fixed_rows + [["NO", "員工姓名", "工號", "聯絡電話", "筆數", "折扣後車資", "ACK"]]
+    rows += summary_data
+    rows.append(["合計", None, None, None, total_count, total_amount, None])
+
+    merges = []
+    for i in range(1, len(fixed_rows) + 1):
+        merges.append(f'A{i}:C{i}')
+        merges.append(f'D{i}:G{i}')
+    merges.append(f"A{len(rows)}:D{len(rows)}")
+
+    # 设置总表格式：全部框線，前三行標題靠右、內容靠左，其餘置中
+    def styled_rows():
+        for row_idx, row in enumerate(rows, start=1):
+            cells = []
+            for col, value in enumerate(row + [None] * (7 - len(row)), start=1):
+                if row_idx > len(fixed_rows):
+                    style = HEADER_STYLE
+                elif col == 1:
+                    style = LABEL_STYLE
+                elif col == 4:
+                    style = VALUE_STYLE
+                else:
+                    style = BODY_STYLE
+                cells.append((value, style))
+            yield cells
+
+    return {'widths': [], 'merges': merges, 'rows': styled_rows()}
+
+
+def employee_sheet_layout(partition, billing_period):
+    rows = partition['rows']
+    total_count = partition['count']
+    total_amount = partition['total']
+
+    # 创建固定的行内容
+    fixed_rows = [
+        ['企業會員乘車服務電子對帳單'],
+        ['客戶名稱：', None, '友訊科技股份有限公司'],
+        ['列帳期間：', None, billing_period],
+    ]
+
+    # 创建统计数据行
+    stats_rows = [
+        ['總筆數', total_count, None, None, None, None, '折扣後：', total_amount],
+        [],
+        ['*車資總計(運送服務費)：', None, None, None, None, None, f"{total_amount}元"],
+        ['乘車券印製費：', None, None, None, None, None, '0元'],
+        ['滯納金：', None, None, None, None, None, '0元'],
+        ['其它費用：', None, None, None, None, None, '0元'],
+        ['本期應繳帳款：', None, None, None, None, None, f"{total_amount}元"],
+        ['特殊費用：', None, None, None, None, None, '0元'],
+    ]
+
+    # 合併第一行單元格，以及客戶名稱、列帳期間的內容
+    max_col = len(rows.columns)
+    last_column = get_column_letter(max_col)
+    merges = [f'A1:{last_column}1', f'C2:{last_column}2', f'C3:{last_column}3']
+
+    # 被合併的儲存格只保留框線
+    merged = {(1, col) for col in range(2, max_col + 1)}
+    merged |= {(row, col) for row in (2, 3) for col in range(4, max_col + 1)}
+
+    # 總筆數、折扣後金額與本期應繳帳款使用粗体
+    start_row = len(fixed_rows) + len(rows) + 2
+    bold = {(start_row, 1), (start_row, 2), (start_row, 7), (start_row, 8)}
+    bold |= {(start_row + 6, 1), (start_row + 6, 7)}
+
+    # 統計行至少寫到第 8 欄，框線只加在數據欄位範圍內
+    width = max(max_col, 8)
+
+    def styled_row(row_idx, values):
+        cells = []
+        for col in range(1, width + 1):
+            value = values[col - 1] if col <= len(values) else None
+            if (row_idx, col) == (1, 1):
+                style = TITLE_STYLE
+            elif (row_idx, col) in merged:
+                style = BORDERED_STYLE
+            elif (row_idx, col) in bold:
+                style = TOTAL_STYLE if col <= max_col else TOTAL_UNBORDERED_STYLE
+            else:
+                style = BODY_STYLE if col <= max_col else BODY_UNBORDERED_STYLE
+            cells.append((value, style))
+        return cells
+
+    def styled_rows():
+        row_idx = 1
+        for row in fixed_rows + [rows.columns.tolist()]:
+            yield styled_row(row_idx, row)
+            row_idx += 1
+
+        for row in rows.itertuples(index=False, name=None):
+            yield styled_row(row_idx, row)
+            row_idx += 1
+
+        for row in stats_rows:
+            yield styled_row(row_idx, row)
+            row_idx += 1
+
+    return {
+        'widths': column_widths(rows.columns, partition['max_lengths']),
+        'merges': merges,
+        'rows': styled_rows(),
+    }
+
+
+def report_sheets(summary_data, partitions):
+    # 輸出時新增的工作表：總表以及每位員工（或每個分組）各一個工作表
+    sheets = [{'title': "總表", 'kind': 'summary', 'data': summary_data}]
+    for partition in partitions:
+        sheets.append(
+            {
+                'title': f"{partition['employee_id']} {partition['employee_name']}",
+                'kind': 'employee',
+                'data': partition,
+            }
+        )
+    return sheets
+
+
+def sheet_rows(sheet):
+    # 工作表的資料行數：總表為員工數，員工工作表為旅次筆數
+    if sheet['kind'] == 'summary':
+        return len(sheet['data'])
+    return len(sheet['data']['rows'])
+
+
+def sheet_layout(sheet, billing_period):
+    if sheet['kind'] == 'summary':
+        return summary_sheet_layout(sheet['data'], billing_period)
+    return employee_sheet_layout(sheet['data'], billing_period)
+
+
+def report_sheet_order(sheet_names, fixed=2):
+    # 只對員工工作表進行排序，保留前兩個工作表不變；根據工作表名稱（員工編號）進行排序
+    return sheet_names[:fixed] + sorted(sheet_names[fixed:], key=lambda x: x.split()[0])
+
+
+def write_sheet(workbook, title, layout):
+    worksheet = workbook.create_sheet(title)
+
+    # 欄寬與合併儲存格須在寫入資料前設定
+    for idx, width in enumerate(layout['widths']):
+        worksheet.column_dimensions[get_column_letter(idx + 1)].width = width
+    for merged_range in layout['merges']:
+        worksheet.merged_cells.add(merged_range)
+
+    # 逐行寫入已設定格式的儲存格
+    for row in layout['rows']:
+        worksheet.append([_styled_cell(worksheet, value, style) for value, style in row])
+
+
+def write_report_workbook(output, original_file, sheets, billing_period, progress=ignore_progress):
+    # 以串流（write-only）模式建立輸出工作簿，每個工作表寫入時即完成格式設定
+    workbook = Workbook(write_only=True)
+    with profile_stage('styles'):
+        register_report_styles(workbook)
+    if original_file is not None:
+        with profile_stage('copy_original'):
+            copy_original_sheets(workbook, original_file)
+    for done, sheet in enumerate(sheets, start=1):
+        with profile_stage('sheet', sheet_rows(sheet), title=sheet['title']):
+            write_sheet(workbook, sheet['title'], sheet_layout(sheet, billing_period))
+        progress('write', done, len(sheets))
+
+    # 在處理完所有工作表後，重新排列工作表；沒有原始工作簿時只固定總表
+    fixed = 2 if original_file is not None else 1
+    with profile_stage('reorder', len(workbook.sheetnames)):
+        for i, sheet_name in enumerate(report_sheet_order(workbook.sheetnames, fixed)):
+            workbook.move_sheet(sheet_name, offset=i - workbook.index(workbook[sheet_name]))
+
+    progress('save', len(sheets), len(sheets))
+    with profile_stage('save'):
+        workbook.save(output)
+
+
+def _add_style_items(styles_xml, tag, child, items):
+    # 在 <tag> 區段末端加入項目並更新 count，回傳新的 XML 與第一個新項目的索引
+    match = re.search(rf'<{tag}\b([^>]*?)(?:/>|>(.*?)</{tag}>)', styles_xml, re.S)
+    if match is None:
+        raise ValueError(f"styles.xml 缺少 <{tag}> 區段")
+
+    attributes = re.sub(r'\s+count="[^"]*"', '', match.group(1))
+    body = match.group(2) or ''
+    start = len(re.findall(rf'<{child}\b', body))
+    section = f'<{tag}{attributes} count="{start + len(items)}">{body}{"".join(items)}</{tag}>'
+    return styles_xml[: match.start()] + section + styles_xml[match.end() :], start
+
+
+def add_report_styles(styles_xml):
+    # 將報表的具名樣式與日期格式加入原始的 styles.xml，回傳新的 XML 與樣式索引
+    if '<fonts' not in styles_xml or '<cellXfs' not in styles_xml:
+        raise ValueError("無法辨識 styles.xml 的格式")
+
+    # 補上缺少的選用區段
+    if '<numFmts' not in styles_xml:
+        styles_xml = re.sub(r'(<styleSheet\b[^>]*>)', r'\1<numFmts count="0"/>', styles_xml, 1)
+    if '<cellStyleXfs' not in styles_xml:
+        styles_xml = styles_xml.replace(
+            '<cellXfs',
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/>'
+            '</cellStyleXfs><cellXfs',
+            1,
+        )
+    if '<cellStyles' not in styles_xml:
+        styles_xml = styles_xml.replace('</cellXfs>', '</cellXfs><cellStyles count="0"/>', 1)
+
+    # 字型與框線：相同定義只加入一次
+    def serialize(item):
+        return tostring(item.to_tree()).decode('utf-8')
+
+    fonts = list(dict.fromkeys(serialize(s['font']) for s in REPORT_STYLES.values()))
+    borders = list(
+        dict.fromkeys(serialize(s['border']) for s in REPORT_STYLES.values() if 'border' in s)
+    )
+    styles_xml, first_font = _add_style_items(styles_xml, 'fonts', 'font', fonts)
+    styles_xml, first_border = _add_style_items(styles_xml, 'borders', 'border', borders)
+
+    # 日期格式：沿用既有的相同格式，否則新增自訂格式
+    format_ids = {
+        html.unescape(code): int(format_id)
+        for format_id, code in re.findall(
+            r'<numFmt\b[^>]*?numFmtId="(\d+)"[^>]*?formatCode="([^"]*)"', styles_xml
+        )
+    }
+    next_format_id = max([163] + list(format_ids.values())) + 1
+    new_formats = []
+    for code in DATE_FORMATS.values():
+        if code not in format_ids:
+            format_ids[code] = next_format_id
+            new_formats.append(
+                f'<numFmt numFmtId="{next_format_id}" formatCode="{html.escape(code)}"/>'
+            )
+            next_format_id += 1
+    styles_xml, _ = _add_style_items(styles_xml, 'numFmts', 'numFmt', new_formats)
+
+    def xf(attributes, format_id=0, xf_id=None):
+        font_id = first_font + fonts.index(serialize(attributes['font']))
+        border_id = 0
+        if 'border' in attributes:
+            border_id = first_border + borders.index(serialize(attributes['border']))
+        element = (
+            f'<xf numFmtId="{format_id}" fontId="{font_id}" fillId="0" borderId="{border_id}"'
+            ' applyFont="1" applyBorder="1"'
+        )
+        if format_id:
+            element += ' applyNumberFormat="1"'
+        if xf_id is not None:
+            element += f' xfId="{xf_id}"'
+        if 'alignment' in attributes:
+            return f'{element} applyAlignment="1">{serialize(attributes["alignment"])}</xf>'
+        return f'{element}/>'
+
+    # 具名樣式：同名樣式已存在時（例如再次上傳輸出的檔案）沿用原有的定義
+    style_xf_ids = {
+        html.unescape(name): int(xf_id)
+        for name, xf_id in re.findall(
+            r'<cellStyle\b[^>]*?name="([^"]*)"[^>]*?xfId="(\d+)"', styles_xml
+        )
+    }
+    new_names = [name for name in REPORT_STYLES if name not in style_xf_ids]
+    styles_xml, first_style_xf = _add_style_items(
+        styles_xml, 'cellStyleXfs', 'xf', [xf(REPORT_STYLES[name]) for name in new_names]
+    )
+    cell_styles = []
+    for idx, name in enumerate(new_names):
+        style_xf_ids[name] = first_style_xf + idx
+        cell_styles.append(f'<cellStyle name="{html.escape(name)}" xfId="{first_style_xf + idx}"/>')
+    styles_xml, _ = _add_style_items(styles_xml, 'cellStyles', 'cellStyle', cell_styles)
+
+    # 儲存格樣式：每個具名樣式一般格式一個，另加日期、時間格式的變化
+    keys = []
+    cell_xfs = []
+    for name, attributes in REPORT_STYLES.items():
+        keys.append(name)
+        cell_xfs.append(xf(attributes, xf_id=style_xf_ids[name]))
+        for kind, code in DATE_FORMATS.items():
+            keys.append((name, kind))
+            cell_xfs.append(xf(attributes, format_ids[code], style_xf_ids[name]))
+    styles_xml, first_cell_xf = _add_style_items(styles_xml, 'cellXfs', 'xf', cell_xfs)
+
+    style_ids = {key: first_cell_xf + idx for idx, key in enumerate(keys)}
+    return styles_xml, style_ids
+
+
+def _cell_xml(ref, value, style, style_ids):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return f'<c r="{ref}" s="{style_ids[style]}"/>'
+
+    if isinstance(value, str):
+        text = escape(ILLEGAL_CHARACTERS_RE.sub('', value))
+        if not text:
+            return f'<c r="{ref}" s="{style_ids[style]}"/>'
+        space = ' xml:space="preserve"' if text != text.strip() else ''
+        return (
+            f'<c r="{ref}" s="{style_ids[style]}" t="inlineStr"><is><t{space}>{text}</t></is></c>'
+        )
+
+    if isinstance(value, (bool, np.bool_)):
+        return f'<c r="{ref}" s="{style_ids[style]}" t="b"><v>{int(value)}</v></c>'
+
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return f'<c r="{ref}" s="{style_ids[style]}"><v>{value}</v></c>'
+
+    if isinstance(value, (datetime, date, time)):
+        if isinstance(value, datetime):
+            kind = 'datetime'
+        elif isinstance(value, date):
+            kind = 'date'
+        else:
+            kind = 'time'
+        return f'<c r="{ref}" s="{style_ids[(style, kind)]}"><v>{to_excel(value)}</v></c>'
+
+    return _cell_xml(ref, str(value), style, style_ids)
+
+
+def sheet_xml_chunks(layout, style_ids):
+    yield (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        f'xmlns:r="{RELATIONSHIPS_NS}">'
+    )
+
+    if layout['widths']:
+        columns = ''.join(
+            f'<col min="{idx}" max="{idx}" width="{width}" customWidth="1"/>'
+            for idx, width in enumerate(layout['widths'], start=1)
+        )
+        yield f'<cols>{columns}</cols>'
+
+    yield '<sheetData>'
+    for row_idx, row in enumerate(layout['rows'], start=1):
+        cells = ''.join(
+            _cell_xml(f'{get_column_letter(col)}{row_idx}', value, style, style_ids)
+            for col, (value, style) in enumerate(row, start=1)
+        )
+        yield f'<row r="{row_idx}">{cells}</row>'
+    yield '</sheetData>'
+
+    if layout['merges']:
+        merges = ''.join(f'<mergeCell ref="{merged_range}"/>' for merged_range in layout['merges'])
+        yield f'<mergeCells count="{len(layout["merges"])}">{merges}</mergeCells>'
+
+    yield '</worksheet>'
+
+
+def render_sheet_xml(sheet, billing_period, style_ids):
+    # 在工作行程中執行：由工作表的資料產生完整的 worksheet XML
+    chunks = sheet_xml_chunks(sheet_layout(sheet, billing_period), style_ids)
+    return ''.join(chunks).encode('utf-8')
+
+
+def process_context(preload=()):
+    # 避免在多執行緒的 Streamlit 伺服器中直接 fork
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__, *preload])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def sheet_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=SHEET_WORKERS, mp_context=process_context())
+        return _executor
+
+
+def reset_sheet_executor(executor):
+    # 工作行程異常結束（例如因記憶體不足被系統終止）後行程池無法再使用，下次需要時重新建立
+    global _executor
+
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def employee_workbook(sheet, billing_period):
+    # 在工作行程中執行：產生只含單一工作表的工作簿
+    output = io.BytesIO()
+    write_report_workbook(output, None, [sheet], billing_period)
+    return sheet['title'], output.getvalue()
+
+
+def _render_workbooks(sheets, billing_period):
+    # 依完成的先後回傳各工作簿，同時進行中的工作數有上限，記憶體用量不隨工作表數增加
+    if SHEET_WORKERS <= 1 or len(sheets) < PARALLEL_MIN_SHEETS:
+        for sheet in sheets:
+            yield employee_workbook(sheet, billing_period)
+        return
+
+    executor = sheet_executor()
+    pending = {}
+    finished = set()
+    try:
+        for idx, sheet in enumerate(sheets):
+            pending[executor.submit(employee_workbook, sheet, billing_period)] = idx
+            if len(pending) >= SHEET_WORKERS * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    finished.add(pending.pop(future))
+                    yield result
+        for future in as_completed(list(pending)):
+            result = future.result()
+            finished.add(pending.pop(future))
+            yield result
+    except BrokenProcessPool:
+        # 行程池損壞時重新建立，尚未完成的工作簿改在本行程產生
+        reset_sheet_executor(executor)
+        for idx, sheet in enumerate(sheets):
+            if idx not in finished:
+                yield employee_workbook(sheet, billing_period)
+
+
+def write_employee_archive(output, sheets, billing_period, progress=ignore_progress):
+    # xlsx 本身已經壓縮，放入 ZIP 時不再壓縮
+    names = set()
+    modified = datetime.now().timetuple()[:6]
+    rows = {sheet['title']: sheet_rows(sheet) for sheet in sheets}
+    rendered = _render_workbooks(sheets, billing_period)
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+        for done in range(1, len(sheets) + 1):
+            # 平行產生時各工作簿依完成順序回傳，記錄的是等待與寫入的時間
+            with profile_stage('sheet') as stage:
+                title, workbook = next(rendered)
+                stage.update(rows=rows[title], title=title)
+                name = re.sub(r'[\\/:*?"<>|]', '_', title)
+                name = avoid_duplicate_name(names, name)
+                names.add(name)
+                archive.writestr(zipfile.ZipInfo(f"{name}.xlsx", date_time=modified), workbook)
+            progress('write', done, len(sheets))
+        progress('save', len(sheets), len(sheets))
+
+
+def sheet_cache_key(sheet, billing_period, style_ids):
+    # 員工工作表的內容只取決於其旅次資料、列帳期間與樣式編號；總表含分機資料，每次重建
+    if sheet['kind'] != 'employee':
+        return None
+    rows = sheet['data']['rows']
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(list(rows.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes())
+    return digest.hexdigest(), billing_period, frozenset(style_ids.items())
+
+
+def _render_uncached(sheets, billing_period, style_ids):
+    # 工作表數量夠多時交由行程池平行產生 XML，結果依照原本的順序回傳
+    if SHEET_WORKERS > 1 and len(sheets) >= PARALLEL_MIN_SHEETS:
+        # 第一批工作在此時即送出，呼叫端複製原始內容的同時其他行程即可開始產生
+        executor = sheet_executor()
+        window = deque()
+        try:
+            for sheet in sheets[: SHEET_WORKERS * 2]:
+                window.append(executor.submit(render_sheet_xml, sheet, billing_period, style_ids))
+        except BrokenProcessPool:
+            reset_sheet_executor(executor)
+        else:
+            return _parallel_results(executor, window, sheets, billing_period, style_ids)
+    return (render_sheet_xml(sheet, billing_period, style_ids) for sheet in sheets)
+
+
+def _parallel_results(executor, window, sheets, billing_period, style_ids):
+    # 依序回傳行程池的結果，每取出一個才送出下一個，同時進行中的工作數與等待寫入的 XML 有上限；
+    # 行程池損壞時重新建立，其餘工作表改在本行程產生
+    done = 0
+    try:
+        while window:
+            xml = window.popleft().result()
+            submitted = done + 1 + len(window)
+            if submitted < len(sheets):
+                window.append(
+                    executor.submit(render_sheet_xml, sheets[submitted], billing_period, style_ids)
+                )
+            done += 1
+            yield xml
+    except BrokenProcessPool:
+        reset_sheet_executor(executor)
+        for sheet in sheets[done:]:
+            yield render_sheet_xml(sheet, billing_period, style_ids)
+
+
+def clear_sheet_cache():
+    with _sheet_cache_lock:
+        _sheet_cache.clear()
+
+
+def render_sheets(sheets, billing_period, style_ids):
+    # 只重新產生輸入有變動的工作表，其餘沿用先前產生的 XML
+    keys = [sheet_cache_key(sheet, billing_period, style_ids) for sheet in sheets]
+    with _sheet_cache_lock:
+        cached = [_sheet_cache.get(key) if key is not None else None for key in keys]
+    pending = [sheet for sheet, xml in zip(sheets, cached) if xml is None]
+    rendered = _render_uncached(pending, billing_period, style_ids)
+
+    def ordered():
+        for key, xml in zip(keys, cached):
+            if xml is None:
+                xml = next(rendered)
+                if key is not None and len(xml) <= _sheet_cache.maxsize:
+                    with _sheet_cache_lock:
+                        _sheet_cache[key] = xml
+            yield xml
+
+    return ordered()
+
+
+def _xml_attributes(element):
+    return {key: html.unescape(value) for key, value in re.findall(r'([\w:]+)="([^"]*)"', element)}
+
+
+def _part_path(base_dir, target):
+    # 將關聯檔中的 Target 轉為壓縮檔內的路徑
+    if target.startswith('/'):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+
+# 複製原始項目時每次讀寫的位元組數
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+def _copy_compressed(source, info, target):
+    # zipfile 沒有公開複製壓縮資料的方法，這裡依照它寫入項目的方式直接寫入檔頭與壓縮後的資料；
+    # 加密、ZIP64 或檔頭無法辨識的項目回傳 False，改為解壓縮後重新寫入
+    if (
+        info.flag_bits & 0x01
+        or max(info.file_size, info.compress_size, info.header_offset) > zipfile.ZIP64_LIMIT
+        or not target._seekable
+    ):
+        return False
+
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        return False
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    source.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+
+    entry = copy(info)
+    # 大小與 CRC 直接寫在檔頭，不需要資料描述區
+    entry.flag_bits &= ~0x08
+    target.fp.seek(target.start_dir)
+    entry.header_offset = target.start_dir
+    target.fp.write(entry.FileHeader(False))
+
+    remaining = info.compress_size
+    while remaining:
+        chunk = source.fp.read(min(remaining, COPY_CHUNK_BYTES))
+        if not chunk:
+            raise zipfile.BadZipFile(f"{info.filename} 的資料不完整")
+        target.fp.write(chunk)
+        remaining -= len(chunk)
+
+    target.start_dir = target.fp.tell()
+    target.filelist.append(entry)
+    target.NameToInfo[entry.filename] = entry
+    target._didModify = True
+    return True
+
+
+def assemble_report_workbook(
+    output, original_file, sheets, billing_period, progress=ignore_progress
+):
+    # 直接沿用原始 xlsx 中的工作表、共用字串與樣式，只加入新產生的工作表並更新清單
+    with zipfile.ZipFile(original_file) as source:
+        root_rels = source.read('_rels/.rels').decode('utf-8')
+        workbook_path = None
+        for element in re.findall(r'<Relationship\b[^>]*>', root_rels):
+            attributes = _xml_attributes(element)
+            if attributes.get('Type', '').endswith('/officeDocument'):
+                workbook_path = _part_path('', attributes['Target'])
+        if workbook_path is None:
+            raise ValueError("找不到 workbook.xml")
+
+        workbook_dir = posixpath.dirname(workbook_path)
+        rels_path = posixpath.join(
+            workbook_dir, '_rels', f'{posixpath.basename(workbook_path)}.rels'
+        )
+        workbook_xml = source.read(workbook_path).decode('utf-8')
+        rels_xml = source.read(rels_path).decode('utf-8')
+        content_types = source.read('[Content_Types].xml').decode('utf-8')
+
+        relationships = [_xml_attributes(e) for e in re.findall(r'<Relationship\b[^>]*>', rels_xml)]
+        styles_path = next(
+            (
+                _part_path(workbook_dir, rel['Target'])
+                for rel in relationships
+                if rel.get('Type', '').endswith('/styles')
+            ),
+            None,
+        )
+        if styles_path is None:
+            raise ValueError("找不到 styles.xml")
+        with profile_stage('styles'):
+            styles_xml, style_ids = add_report_styles(source.read(styles_path).decode('utf-8'))
+
+        sheets_match = re.search(r'<sheets>(.*?)</sheets>', workbook_xml, re.S)
+        prefix_match = re.search(rf'xmlns:(\w+)="{re.escape(RELATIONSHIPS_NS)}"', workbook_xml)
+        if sheets_match is None or prefix_match is None:
+            raise ValueError("無法辨識 workbook.xml 的格式")
+        sheet_elements = re.findall(r'<sheet\b[^>]*?/>', sheets_match.group(1))
+        # 只認得自行結束的 <sheet/>；有其他寫法時交由 openpyxl 重建，避免遺漏原始工作表
+        if len(sheet_elements) != len(re.findall(r'<sheet\b', sheets_match.group(1))):
+            raise ValueError("無法辨識 workbook.xml 的工作表清單")
+        original_titles = [_xml_attributes(element)['name'] for element in sheet_elements]
+
+        # 為新的工作表配置名稱、sheetId、關聯 Id 與檔案路徑
+        titles = list(original_titles)
+        elements = dict(zip(original_titles, sheet_elements))
+        sheet_id = max(
+            [0] + [int(i) for i in re.findall(r'\bsheetId="(\d+)"', sheets_match.group(1))]
+        )
+        rel_ids = {rel.get('Id') for rel in relationships}
+        part_numbers = [
+            int(number)
+            for number in re.findall(
+                rf'^{re.escape(workbook_dir)}/worksheets/sheet(\d+)\.xml$',
+                '\n'.join(source.namelist()),
+                re.M,
+            )
+        ]
+        part_number = max([0] + part_numbers)
+        rel_number = len(rel_ids)
+
+        new_parts = []
+        new_relationships = []
+        new_overrides = []
+        for sheet in sheets:
+            title = avoid_duplicate_name(titles, sheet['title'])
+            if INVALID_TITLE_REGEX.search(title):
+                raise ValueError(f"工作表名稱包含無效字元：{title}")
+            titles.append(title)
+
+            sheet_id += 1
+            part_number += 1
+            rel_number += 1
+            while f'rId{rel_number}' in rel_ids:
+                rel_number += 1
+            rel_id = f'rId{rel_number}'
+            rel_ids.add(rel_id)
+
+            part = f'{workbook_dir}/worksheets/sheet{part_number}.xml'
+            elements[title] = (
+                f'<sheet name="{html.escape(title)}" sheetId="{sheet_id}" '
+                f'{prefix_match.group(1)}:id="{rel_id}"/>'
+            )
+            new_relationships.append(
+                f'<Relationship Id="{rel_id}" Type="{WORKSHEET_REL_TYPE}" '
+                f'Target="worksheets/sheet{part_number}.xml"/>'
+            )
+            new_overrides.append(
+                f'<Override PartName="/{part}" ContentType="{WORKSHEET_CONTENT_TYPE}"/>'
+            )
+            new_parts.append(part)
+
+        # 依照報表的工作表順序重新排列，並更新引用工作表位置的屬性
+        order = report_sheet_order(titles)
+        positions = {idx: order.index(title) for idx, title in enumerate(original_titles)}
+
+        def remap(match):
+            return f'{match.group(1)}="{positions.get(int(match.group(2)), match.group(2))}"'
+
+        workbook_xml = (
+            workbook_xml[: sheets_match.start(1)]
+            + ''.join(elements[title] for title in order)
+            + workbook_xml[sheets_match.end(1) :]
+        )
+        workbook_xml = re.sub(r'\b(localSheetId|activeTab)="(\d+)"', remap, workbook_xml)
+        rels_xml = rels_xml.replace(
+            '</Relationships>', ''.join(new_relationships) + '</Relationships>'
+        )
+        content_types = content_types.replace('</Types>', ''.join(new_overrides) + '</Types>')
+
+        replaced = {
+            workbook_path: workbook_xml,
+            rels_path: rels_xml,
+            '[Content_Types].xml': content_types,
+            styles_path: styles_xml,
+        }
+
+        # 先送出工作表的產生工作，複製原始內容的同時即可在其他行程中進行
+        rendered = render_sheets(sheets, billing_period, style_ids)
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as target:
+            # 原始的各個部分直接複製壓縮後的資料，不解壓縮也不重新壓縮
+            with profile_stage('copy_original', len(source.infolist())):
+                for info in source.infolist():
+                    if info.filename in replaced:
+                        target.writestr(info, replaced[info.filename].encode('utf-8'))
+                    elif not _copy_compressed(source, info, target):
+                        with source.open(info) as src, target.open(info, 'w') as dst:
+                            shutil.copyfileobj(src, dst)
+
+            modified = datetime.now().timetuple()[:6]
+            for done, (part, sheet) in enumerate(zip(new_parts, sheets), start=1):
+                # 平行產生時記錄的是等待該工作表完成與壓縮寫入的時間
+                with profile_stage('sheet', sheet_rows(sheet), title=sheet['title']):
+                    info = zipfile.ZipInfo(part, date_time=modified)
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    target.writestr(info, next(rendered))
+                progress('write', done, len(sheets))
+            progress('save', len(sheets), len(sheets))
@@ -0,0 +1,367 @@
+import gc
+import hashlib
+import io
+import tempfile
+import zipfile
+import numpy as np
+import pandas as pd
+from profiling import profile_stage
+from report_writer import (
+    assemble_report_workbook,
+    ignore_progress,
+    report_sheets,
+    write_employee_archive,
+    write_report_workbook,
+)
+from statement_store import load_statement, save_statement
+
+
+def file_digest(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+def read_statement_sheet(file_bytes, sheet_name):
+    with profile_stage('read_excel') as stage:
+        df = pd.read_excel(io.BytesIO(file_bytes), sheet_name=sheet_name, header=None)
+        stage['rows'] = len(df)
+    return df
+
+
+def load_statement_or_parse(file_bytes, file_hash, sheet_name, warn=None):
+    # 先查本機的 Parquet 存放區，沒有時才解析 Excel 並存入；最後一項表示是否來自存放區
+    stored = load_statement(file_hash, sheet_name)
+    if stored is not None:
+        return (*stored, True)
+
+    df = read_statement_sheet(file_bytes, sheet_name)
+    processed_df, billing_period = process_dataframe(df, warn)
+    processed_df, memory_usage = normalize_trip_columns(processed_df)
+    save_statement(file_hash, sheet_name, processed_df, billing_period, memory_usage)
+    return processed_df, billing_period, memory_usage, False
+
+
+def parse_extension_input(extension_input):
+    extension = {}
+    for line in extension_input.split('\n'):
+        parts = line.strip().split(':')
+        if len(parts) == 2:
+            employee_id, ext = parts
+            extension[employee_id.strip()] = ext.strip()
+    return extension
+
+
+# 標記掃描時每次處理的行數
+MARKER_SCAN_CHUNK_ROWS = 8192
+
+
+def _find_first_text(columns, match):
+    # 對多個欄位整欄執行字串比對，回傳第一個符合的行位置；非字串的值視為不符合
+    combined = None
+    for column in columns:
+        try:
+            mask = match(column.str).to_numpy(dtype=bool)
+        except AttributeError:
+            # 該區塊內此欄沒有任何字串值
+            continue
+        combined = mask if combined is None else combined | mask
+
+    if combined is not None and combined.any():
+        return int(combined.argmax())
+    return None
+
+
+def find_statement_markers(df):
+    # 以整欄字串比對找出 "旅次明細表"、"總共：" 與 "列帳期間："，各自找到第一筆即停止
+    start_row = None
+    end_row = None
+    billing_period = ''
+    billing_found = False
+
+    # 只有字串欄位可能包含標記文字
+    text_columns = [i for i, dtype in enumerate(df.dtypes) if dtype == object]
+    first_is_text = 0 in text_columns
+
+    for offset in range(0, len(df), MARKER_SCAN_CHUNK_ROWS):
+        if start_row is not None and billing_found and (end_row is not None or not first_is_text):
+            break
+
+        chunk = df.iloc[offset : offset + MARKER_SCAN_CHUNK_ROWS]
+        columns = [chunk.iloc[:, i] for i in text_columns]
+
+        if start_row is None:
+            found = _find_first_text(
+                columns, lambda text: text.contains('旅次明細表', regex=False, na=False)
+            )
+            if found is not None:
+                start_row = offset + found
+
+        if not billing_found:
+            found = _find_first_text(
+                columns, lambda text: text.contains('列帳期間：', regex=False, na=False)
+            )
+            if found is not None:
+                billing_period = chunk.iloc[found, 1]  # 假設列帳期間在第二欄
+                billing_found = True
+
+        if end_row is None and first_is_text:
+            found = _find_first_text(columns[:1], lambda text: text.startswith('總共：', na=False))
+            if found is not None:
+                end_row = offset + found
+
+    # 標題行位於 "旅次明細表" 的下一行
+    header_row = start_row + 1 if start_row is not None else None
+    return header_row, end_row, billing_period
+
+
+def process_dataframe(df, warn=None):
+    # warn：找不到旅次明細表時用來提示的函式（網頁上為 st.warning）
+    with profile_stage('process_dataframe', len(df)):
+        return _process_dataframe(df, warn)
+
+
+def _process_dataframe(df, warn):
+    header_row, end_row, billing_period = find_statement_markers(df)
+
+    if header_row is not None:
+        # 取 "旅次明細表" 之後到 "總共：" 之前的數據（若無 "總共：" 則取到最後）
+        df = df.iloc[header_row:end_row].reset_index(drop=True)
+
+        # 將第一行設為列標題
+        new_header = df.iloc[0]
+        df = df[1:]
+        df.columns = new_header
+
+        # 重置索引
+        df = df.reset_index(drop=True)
+    elif warn is not None:
+        warn("未找到 '旅次明細表' 行，顯示原始數據。")
+
+    return df, billing_period
+
+
+# 旅次明細中可轉為精簡型別的欄位
+CATEGORY_COLUMNS = ['員工編號', '員工姓名', '上車地點', '下車地點']
+INTEGER_COLUMNS = ['車資', '折扣後車資']
+DATETIME_COLUMNS = ['乘車時間']
+
+
+def normalize_trip_columns(df):
+    with profile_stage('normalize', len(df)):
+        return _normalize_trip_columns(df)
+
+
+def _normalize_trip_columns(df):
+    # 只在轉換不會改變任何值時才轉換型別，產生的報表內容因此維持不變
+    memory_before = int(df.memory_usage(deep=True).sum())
+    df = df.copy()
+
+    for idx, column in enumerate(df.columns):
+        values = df.iloc[:, idx]
+        if values.dtype != object:
+            continue
+
+        if column in CATEGORY_COLUMNS:
+            # 類別欄位可含空值，但其餘的值必須全是字串
+            if pd.api.types.infer_dtype(values, skipna=True) == 'string':
+                df.isetitem(idx, values.astype('category'))
+        elif column in INTEGER_COLUMNS:
+            # 有空值或小數時保留原樣，避免變成浮點數
+            if pd.api.types.infer_dtype(values, skipna=False) == 'integer':
+                df.isetitem(idx, values.astype('int64'))
+        elif column in DATETIME_COLUMNS:
+            # 文字形式的時間保留原樣，避免改變輸出儲存格的型別
+            if pd.api.types.infer_dtype(values, skipna=False) in ('datetime', 'datetime64'):
+                df.isetitem(idx, pd.to_datetime(values))
+
+    memory_after = int(df.memory_usage(deep=True).sum())
+    return df, {'before': memory_before, 'after': memory_after}
+
+
+def _text_lengths(values):
+    # 全為午夜的 datetime64 欄位轉字串時會省略時間，先轉回 Timestamp 與 object 欄位同長度
+    if pd.api.types.is_datetime64_any_dtype(values):
+        values = values.astype(object)
+    return values.astype(str).str.len()
+
+
+def partition_trips(df, grouped_employees):
+    employee_column = '員工編號'
+    name_column = '員工姓名'
+    fare_column = '折扣後車資'
+
+    # 一次 groupby 取得每位員工的行位置與車資小計
+    grouped = df.groupby(employee_column, sort=False, observed=True)
+    positions = grouped.indices
+    if fare_column in df.columns:
+        fare_totals = grouped[fare_column].sum().to_dict()
+    else:
+        fare_totals = {}
+
+    # 整份資料只轉換一次字串長度，再依員工取各欄最大值，供各工作表計算欄寬
+    text_lengths = pd.DataFrame(
+        {idx: _text_lengths(df.iloc[:, idx]) for idx in range(len(df.columns))}
+    )
+    employee_lengths = text_lengths.groupby(df[employee_column].to_numpy(), sort=False).max()
+    length_rows = {employee: idx for idx, employee in enumerate(employee_lengths.index)}
+    length_matrix = employee_lengths.to_numpy()
+
+    partitions = []
+    assigned = set()
+
+    # 分組的員工合併為一個工作表，使用 grouped_employees 中的第一個員工編號作為代表
+    for group, employees in grouped_employees.items():
+        if not employees:
+            continue
+        assigned.update(employees)
+
+        members = [employee for employee in dict.fromkeys(employees) if employee in positions]
+        if not members:
+            continue
+
+        # 保持原始順序後再按照員工編號排序
+        member_rows = np.sort(np.concatenate([positions[employee] for employee in members]))
+        # 以原始的字串值排序，同一員工各行的先後與轉換型別前相同
+        rows = df.take(member_rows).sort_values(
+            by=employee_column, key=lambda column: column.astype(object)
+        )
+
+        first_employee_id = employees[0]
+        if first_employee_id in positions:
+            first_employee_name = df[name_column].iat[positions[first_employee_id][0]]
+        else:
+            first_employee_name = rows[name_column].iloc[0]
+
+        partitions.append(
+            {
+                'employee_id': first_employee_id,
+                'employee_name': first_employee_name,
+                'rows': rows,
+                'count': len(rows),
+                'total': sum(fare_totals.get(employee, 0) for employee in members),
+                'max_lengths': length_matrix[[length_rows[employee] for employee in members]].max(
+                    axis=0
+                ),
+            }
+        )
+
+    # 未分組的員工各自一個工作表
+    for employee, employee_rows in positions.items():
+        if employee in assigned:
+            continue
+
+        rows = df.take(employee_rows).reset_index(drop=True)
+        partitions.append(
+            {
+                'employee_id': employee,
+                'employee_name': rows[name_column].iloc[0],
+                'rows': rows,
+                'count': len(rows),
+                'total': fare_totals.get(employee, 0),
+                'max_lengths': length_matrix[length_rows[employee]],
+            }
+        )
+
+    return partitions
+
+
+def build_report_sheets(df, grouped_employees, extension):
+    employee_column = '員工編號'
+    name_column = '員工姓名'
+
+    # 缺少必要的欄位時回傳 None，由呼叫端提示使用者
+    if employee_column not in df.columns or name_column not in df.columns:
+        return None
+
+    # 將每筆旅次分配到所屬的工作表，同時取得筆數與車資合計
+    with profile_stage('partition', len(df)):
+        partitions = partition_trips(df, grouped_employees)
+
+    summary_data = []
+    for partition in partitions:
+        summary_data.append(
+            [
+                len(summary_data) + 1,
+                partition['employee_name'],
+                partition['employee_id'],
+                extension.get(partition['employee_id'], ""),
+                partition['count'],
+                partition['total'],
+                None,
+            ]
+        )
+
+    # 根據員工編號排序 summary_data
+    summary_data.sort(key=lambda x: x[2])  # x[2] 是員工編號
+    for i, row in enumerate(summary_data, start=1):
+        row[0] = i  # 更新序號
+
+    return report_sheets(summary_data, partitions)
+
+
+def report_output():
+    # 輸出寫入磁碟上的暫存檔，產生過程中不必在記憶體中保留完整的副本
+    return tempfile.TemporaryFile()
+
+
+def create_employee_sheets(
+    df,
+    billing_period,
+    original_file,
+    grouped_employees,
+    extension,
+    output=None,
+    progress=ignore_progress,
+):
+    progress('partition')
+    sheets = build_report_sheets(df, grouped_employees, extension)
+    if sheets is None:
+        return None
+
+    # 将修改后的工作保存到暫存檔中
+    if output is None:
+        output = report_output()
+    if original_file is None:
+        # 合併多份對帳單時沒有可沿用的原始工作簿
+        write_report_workbook(output, None, sheets, billing_period, progress)
+    else:
+        try:
+            assemble_report_workbook(output, original_file, sheets, billing_period, progress)
+        except (ValueError, KeyError, zipfile.BadZipFile):
+            # 無法直接沿用原始檔案的結構時，改以 openpyxl 重建整個工作簿
+            output.seek(0)
+            output.truncate()
+            write_report_workbook(output, original_file, sheets, billing_period, progress)
+
+    # openpyxl 的物件彼此循環參照，主動回收，讓工作簿在提供下載前就釋放
+    gc.collect()
+    output.seek(0)
+
+    return output
+
+
+def create_employee_archive(
+    df, billing_period, grouped_employees, extension, output=None, progress=ignore_progress
+):
+    progress('partition')
+    sheets = build_report_sheets(df, grouped_employees, extension)
+    if sheets is None:
+        return None
+
+    # 每個工作表各自一個 Excel 文件，完成一個就寫入 ZIP，產生期間不必把所有文件留在記憶體中；
+    # 批次模式直接寫入輸出檔，App 則在完成後讀出整份 ZIP 供下載
+    if output is None:
+        output = report_output()
+    write_employee_archive(output, sheets, billing_period, progress)
+    output.seek(0)
+
+    return output
+
+
+def parse_group_input(grouped_employees_input):
+    grouped_employees = {}
+    if grouped_employees_input.strip():  # 只有當輸入不為空時才處理
+        for i, group in enumerate(grouped_employees_input.split('\n')):
+            employees = [emp.strip() for emp in group.split(',') if emp.strip()]
+            if employees:
+                grouped_employees[f'Group_{i+1}'] = employees
+    return grouped_employees
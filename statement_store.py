@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from profiling import profile_stage
+
+# 整理後的旅次資料以 Parquet 存放在本機，重新上傳相同檔案時不必再解析 Excel
+STORE_DIR = Path(
+    os.environ.get('STATEMENT_STORE_DIR', Path.home() / '.cache' / 'taxi_statement_store')
+)
+
+# 存放空間上限（超過時刪除最久未使用的檔案）
+STORE_MAX_BYTES = 512 * 1024 * 1024
+
+METADATA_KEY = b'statement'
+
+# 存放資料的格式版本：process_dataframe 或 normalize_trip_columns 的輸出改變時須遞增，
+# 舊版本的檔案不再被讀到，之後由容量上限淘汰
+STORE_VERSION = 1
+
+
+def _store_path(file_hash, sheet_name):
+    key = hashlib.sha256(f"{STORE_VERSION}\0{file_hash}\0{sheet_name}".encode('utf-8')).hexdigest()
+    return STORE_DIR / f"{key}.parquet"
+
+
+def load_statement(file_hash, sheet_name):
+    path = _store_path(file_hash, sheet_name)
+    try:
+        with profile_stage('store_load') as stage:
+            table = pq.read_table(path)
+            metadata = json.loads(table.schema.metadata[METADATA_KEY])
+            if metadata.get('version') != STORE_VERSION:
+                raise ValueError("存放資料的版本不符")
+            df = table.to_pandas()
+            stage['rows'] = len(df)
+        # 更新修改時間，作為淘汰順序的依據
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    except (pa.ArrowException, OSError, KeyError, ValueError):
+        # 損壞或格式不符的檔案直接捨棄，改為重新解析
+        path.unlink(missing_ok=True)
+        return None
+
+    # Arrow 會把只含數字或日期的 object 欄位轉為數值型別、空值讀回為 None，皆還原為原本的樣子
+    for idx in metadata['object_columns']:
+        column = df.iloc[:, idx].astype(object)
+        df.isetitem(idx, column.where(column.notna(), np.nan))
+    return df, metadata['billing_period'], metadata['memory_usage']
+
+
+def save_statement(file_hash, sheet_name, df, billing_period, memory_usage):
+    # 欄名非字串或重複、含 Arrow 無法表示的值時不存放
+    columns = list(df.columns)
+    if not all(isinstance(column, str) for column in columns) or len(set(columns)) != len(columns):
+        return False
+
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = {
+            'version': STORE_VERSION,
+            'billing_period': billing_period,
+            'memory_usage': memory_usage,
+            'object_columns': [idx for idx, dtype in enumerate(df.dtypes) if dtype == object],
+        }
+        table = table.replace_schema_metadata(
+            {**table.schema.metadata, METADATA_KEY: json.dumps(metadata, ensure_ascii=False)}
+        )
+    except (pa.ArrowException, TypeError, ValueError):
+        return False
+
+    try:
+        STORE_DIR.mkdir(parents=True, exist_ok=True)
+        # 先寫入暫存檔再改名，其他行程不會讀到寫到一半的檔案
+        fd, temp_path = tempfile.mkstemp(dir=STORE_DIR, suffix='.tmp')
+        os.close(fd)
+        try:
+            with profile_stage('store_save', table.num_rows):
+                pq.write_table(table, temp_path)
+            os.replace(temp_path, _store_path(file_hash, sheet_name))
+        finally:
+            Path(temp_path).unlink(missing_ok=True)
+    except OSError:
+        return False
+
+    evict_statements()
+    return True
+
+
+def evict_statements(max_bytes=STORE_MAX_BYTES):
+    entries = []
+    for path in STORE_DIR.glob('*.parquet'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
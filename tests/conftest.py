@@ -0,0 +1,35 @@
+from pathlib import Path
+import sys
+import pytest
+
+# 模組都放在專案根目錄
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmark import generate_statement  # noqa: E402
+import statement_store  # noqa: E402
+from statement_pipeline import (  # noqa: E402
+    build_report_sheets,
+    file_digest,
+    load_statement_or_parse,
+)
+
+
+@pytest.fixture(autouse=True)
+def store_dir(tmp_path, monkeypatch):
+    # 每個測試使用各自的 Parquet 存放區
+    monkeypatch.setattr(statement_store, 'STORE_DIR', tmp_path / 'store')
+    return tmp_path / 'store'
+
+
+@pytest.fixture(scope='session')
+def statement_bytes():
+    return generate_statement(400, 40, seed=1).getvalue()
+
+
+@pytest.fixture
+def report(statement_bytes):
+    # 整理後的對帳單與報表的各個工作表
+    df, billing_period, _, _ = load_statement_or_parse(
+        statement_bytes, file_digest(statement_bytes), '對帳單'
+    )
+    return df, billing_period, build_report_sheets(df, {}, {})
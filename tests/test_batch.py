@@ -0,0 +1,35 @@
+import io
+from openpyxl import load_workbook
+import pytest
+from batch import output_path_for, process_statement
+
+
+def write_statement(path, statement_bytes, period=None):
+    workbook = load_workbook(io.BytesIO(statement_bytes))
+    if period is not None:
+        for row in workbook.active.iter_rows():
+            for cell in row:
+                if isinstance(cell.value, str) and '~' in cell.value:
+                    cell.value = period
+    workbook.save(path)
+    return path
+
+
+@pytest.mark.parametrize('per_employee', [False, True])
+def test_failed_statement_leaves_no_output(tmp_path, statement_bytes, per_employee):
+    folder = tmp_path / 'statements'
+    folder.mkdir()
+    good = write_statement(folder / 'good.xlsx', statement_bytes)
+    # 列帳期間沒有 '~' 時，複製原始工作表之後才會在產生總表時失敗
+    bad = write_statement(folder / 'bad.xlsx', statement_bytes, period='2024 年 08 月')
+
+    result = process_statement(
+        good, output_path_for(good, folder), None, {}, {}, per_employee=per_employee
+    )
+    assert 'error' not in result
+    with pytest.raises(IndexError):
+        process_statement(bad, output_path_for(bad, folder), None, {}, {}, per_employee)
+
+    assert sorted(path.name for path in folder.iterdir()) == sorted(
+        ['bad.xlsx', 'good.xlsx', result['output']]
+    )
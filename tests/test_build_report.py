@@ -0,0 +1,55 @@
+from concurrent.futures import Future
+import tracemalloc
+from app import WORKBOOK_OUTPUT, build_report, report_cache_key
+from benchmark import generate_statement
+import build_jobs
+import report_writer
+from statement_pipeline import file_digest, load_statement_or_parse
+
+
+def test_build_report_holds_a_single_copy_of_the_output(monkeypatch):
+    monkeypatch.setattr(report_writer, 'SHEET_WORKERS', 1)
+    statement = generate_statement(2000, 400, seed=2).getvalue()
+    df, billing_period, _, _ = load_statement_or_parse(statement, file_digest(statement), '對帳單')
+    key = report_cache_key([('statement', '對帳單')], {}, {}, WORKBOOK_OUTPUT)
+
+    # 先產生一次，讓工作表快取中的 XML 在開始追蹤前就已配置
+    build_report(key, df, billing_period, statement, report_writer.ignore_progress)
+
+    marks = {}
+
+    def progress(stage, done=0, total=0):
+        if stage not in marks:
+            marks[stage] = tracemalloc.get_traced_memory()[0]
+
+    tracemalloc.start()
+    try:
+        output = build_report(key, df, billing_period, statement, progress)
+        held = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    # 寫入各工作表的期間輸出在磁碟上，記憶體不隨輸出檔案成長
+    assert marks['save'] - marks['write'] < 0.5 * len(output)
+    # 完成後只保留回傳的那一份內容
+    assert held < 2 * len(output)
+
+
+def _finished_job(size):
+    future = Future()
+    future.set_result(b'x' * size)
+    return {'future': future}
+
+
+def test_finished_jobs_are_bounded_by_size(monkeypatch):
+    monkeypatch.setattr(build_jobs, '_jobs', {})
+    monkeypatch.setattr(build_jobs, 'FINISHED_JOBS_MAX_BYTES', 250)
+    for key in 'abcd':
+        build_jobs._jobs[key] = _finished_job(100)
+    build_jobs._evict_finished_jobs()
+    assert list(build_jobs._jobs) == ['c', 'd']
+
+    # 最新完成的工作即使超過上限也保留
+    build_jobs._jobs['e'] = _finished_job(1000)
+    build_jobs._evict_finished_jobs()
+    assert list(build_jobs._jobs) == ['e']
@@ -0,0 +1,57 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from app import ingest_statement, new_consolidation
+from statement_pipeline import normalize_trip_columns
+
+COLUMNS = ['序號', '乘車時間', '員工編號', '員工姓名', '上車地點', '下車地點', '車資', '折扣後車資']
+
+TRIPS = [
+    [1, datetime(2024, 8, 1, 9, 0), '00101', '王小明', '台北車站', '松山機場', 200, 190],
+    [2, datetime(2024, 8, 2, 0, 0), '00102', '陳美玲', '桃園機場', '台北車站', 110, 105],
+]
+
+PERIOD = '2024 年 08 月 01 日 ~ 2024 年 08 月 31 日'
+
+
+def statement(trips):
+    # 與解析後相同：各欄先是 object，再依內容轉換型別
+    df = pd.DataFrame([list(trip) for trip in trips], columns=COLUMNS, dtype=object)
+    return normalize_trip_columns(df)[0]
+
+
+@pytest.mark.parametrize(
+    'extra_trip, column',
+    [
+        # 空白的車資讓折扣後車資維持 object，另一份則轉為 int64
+        (
+            [3, datetime(2024, 8, 3, 8, 0), '00101', '王小明', '台北車站', '新竹', 300, np.nan],
+            '折扣後車資',
+        ),
+        # 文字形式的時間讓乘車時間維持 object，另一份則轉為 datetime64
+        ([3, '2024/08/03 08:00', '00101', '王小明', '台北車站', '新竹', 300, 285], '乘車時間'),
+    ],
+)
+def test_overlapping_statements_with_different_dtypes_dedupe(extra_trip, column):
+    first = statement(TRIPS)
+    # 第二份對帳單重新編號，並多一筆旅次
+    second = statement([[idx + 1, *trip[1:]] for idx, trip in enumerate(TRIPS + [extra_trip])])
+    assert first[column].dtype != second[column].dtype
+
+    consolidation = new_consolidation()
+    ingest_statement(consolidation, ('a', '對帳單'), 'A', first, PERIOD)
+    ingest_statement(consolidation, ('b', '對帳單'), 'B', second, PERIOD)
+
+    assert [source['added'] for source in consolidation['sources']] == [2, 1]
+    assert len(consolidation['trips']) == 3
+    assert consolidation['trips']['車資'].sum() == 200 + 110 + 300
+
+
+def test_reingesting_the_same_statement_adds_nothing():
+    consolidation = new_consolidation()
+    ingest_statement(consolidation, ('a', '對帳單'), 'A', statement(TRIPS), PERIOD)
+    ingest_statement(consolidation, ('a2', '對帳單'), 'A2', statement(TRIPS), PERIOD)
+
+    assert [source['added'] for source in consolidation['sources']] == [2, 0]
+    assert len(consolidation['trips']) == 2
@@ -0,0 +1,45 @@
+import threading
+from profiling import profile_stage, profiling
+
+
+def test_single_profile_records_peak():
+    records = []
+    with profiling(records):
+        with profile_stage('outer'):
+            with profile_stage('inner'):
+                data = bytearray(4 * 1024**2)
+            del data
+    peaks = {record['stage']: record['peak_mb'] for record in records}
+    assert peaks['inner'] >= 4
+    assert peaks['outer'] >= peaks['inner']
+
+
+def test_overlapping_profiles_leave_peak_empty():
+    started = threading.Event()
+    finish = threading.Event()
+    other = []
+
+    def other_session():
+        with profiling(other):
+            with profile_stage('other'):
+                started.set()
+                finish.wait(10)
+
+    records = []
+    with profiling(records):
+        with profile_stage('outer'):
+            with profile_stage('inner'):
+                # 另一個紀錄在此階段期間開始
+                thread = threading.Thread(target=other_session)
+                thread.start()
+                started.wait(10)
+            finish.set()
+            thread.join()
+        with profile_stage('after'):
+            pass
+
+    peaks = {record['stage']: record['peak_mb'] for record in records}
+    assert peaks['inner'] is None
+    assert peaks['outer'] is None
+    assert peaks['after'] is not None
+    assert other[0]['peak_mb'] is None
@@ -0,0 +1,183 @@
+from copy import copy
+import io
+import re
+import zipfile
+import pytest
+from openpyxl import load_workbook
+import report_writer
+
+
+def test_assembled_workbook_keeps_original_parts_compressed_as_is(statement_bytes, report):
+    _, billing_period, sheets = report
+    output = io.BytesIO()
+    report_writer.assemble_report_workbook(
+        output, io.BytesIO(statement_bytes), sheets, billing_period
+    )
+
+    with zipfile.ZipFile(io.BytesIO(statement_bytes)) as source, zipfile.ZipFile(output) as result:
+        assert result.testzip() is None
+        for info in source.infolist():
+            if info.filename.endswith('worksheets/sheet1.xml'):
+                copied = result.getinfo(info.filename)
+                assert (copied.CRC, copied.compress_size) == (info.CRC, info.compress_size)
+                assert result.read(info.filename) == source.read(info.filename)
+
+
+def test_unrecognised_sheet_elements_fall_back(statement_bytes, report):
+    _, billing_period, sheets = report
+
+    # 把 <sheet .../> 改寫為 <sheet ...></sheet>
+    original = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(statement_bytes)) as source, zipfile.ZipFile(
+        original, 'w'
+    ) as target:
+        for info in source.infolist():
+            data = source.read(info.filename)
+            if info.filename == 'xl/workbook.xml':
+                data = re.sub(rb'<sheet\b([^>]*?)/>', rb'<sheet\1></sheet>', data)
+            target.writestr(info, data)
+
+    with pytest.raises(ValueError):
+        report_writer.assemble_report_workbook(
+            io.BytesIO(), io.BytesIO(original.getvalue()), sheets, billing_period
+        )
+
+
+@pytest.fixture
+def sheet_pool(monkeypatch):
+    # 即使工作表不多也交由兩個工作行程平行產生，結束後關閉行程池
+    monkeypatch.setattr(report_writer, 'SHEET_WORKERS', 2)
+    monkeypatch.setattr(report_writer, 'PARALLEL_MIN_SHEETS', 2)
+    report_writer.clear_sheet_cache()
+    yield
+    if report_writer._executor is not None:
+        report_writer.reset_sheet_executor(report_writer._executor)
+    report_writer.clear_sheet_cache()
+
+
+def _cell_styles(cell):
+    # 儲存格的樣式屬性是代理物件，複製出實際的樣式再比較
+    return (
+        copy(cell.font),
+        copy(cell.border),
+        copy(cell.alignment),
+        copy(cell.fill),
+        cell.number_format,
+    )
+
+
+def assert_same_workbook(expected, actual, styled_titles):
+    # 原始工作表經 openpyxl 重建時預設字型會被改寫，樣式只比對新產生的工作表
+    expected = load_workbook(io.BytesIO(expected))
+    actual = load_workbook(io.BytesIO(actual))
+    assert actual.sheetnames == expected.sheetnames
+    for title in expected.sheetnames:
+        want, got = expected[title], actual[title]
+        assert sorted(map(str, got.merged_cells.ranges)) == sorted(
+            map(str, want.merged_cells.ranges)
+        ), title
+        assert {key: dimension.width for key, dimension in got.column_dimensions.items()} == {
+            key: dimension.width for key, dimension in want.column_dimensions.items()
+        }, title
+        assert got.max_row == want.max_row and got.max_column == want.max_column, title
+        for want_row, got_row in zip(want.iter_rows(), got.iter_rows()):
+            for want_cell, got_cell in zip(want_row, got_row):
+                assert got_cell.value == want_cell.value, (title, want_cell.coordinate)
+                if title not in styled_titles:
+                    continue
+                assert _cell_styles(got_cell) == _cell_styles(want_cell), (
+                    title,
+                    want_cell.coordinate,
+                )
+
+
+def test_parallel_assembled_workbook_matches_openpyxl(statement_bytes, report, sheet_pool):
+    _, billing_period, sheets = report
+
+    expected = io.BytesIO()
+    report_writer.write_report_workbook(
+        expected, io.BytesIO(statement_bytes), sheets, billing_period
+    )
+    actual = io.BytesIO()
+    report_writer.assemble_report_workbook(
+        actual, io.BytesIO(statement_bytes), sheets, billing_period
+    )
+
+    assert report_writer._executor is not None
+    assert_same_workbook(
+        expected.getvalue(), actual.getvalue(), {sheet['title'] for sheet in sheets}
+    )
+
+
+def _kill_workers(statement_bytes, sheets, billing_period):
+    # 先產生一次報表讓行程池啟動工作行程，再將它們全部終止
+    report_writer.clear_sheet_cache()
+    report_writer.assemble_report_workbook(
+        io.BytesIO(), io.BytesIO(statement_bytes), sheets, billing_period
+    )
+    executor = report_writer._executor
+    for process in list(executor._processes.values()):
+        process.kill()
+        process.join()
+    report_writer.clear_sheet_cache()
+    return executor
+
+
+def test_broken_sheet_pool_is_replaced(statement_bytes, report, sheet_pool):
+    _, billing_period, sheets = report
+    titles = {sheet['title'] for sheet in sheets}
+    expected = io.BytesIO()
+    report_writer.write_report_workbook(
+        expected, io.BytesIO(statement_bytes), sheets, billing_period
+    )
+
+    # 工作行程被終止後，目前的報表改在本行程完成，之後的報表使用新的行程池
+    for _ in range(2):
+        executor = _kill_workers(statement_bytes, sheets, billing_period)
+        output = io.BytesIO()
+        report_writer.assemble_report_workbook(
+            output, io.BytesIO(statement_bytes), sheets, billing_period
+        )
+        assert report_writer._executor is not executor
+        assert_same_workbook(expected.getvalue(), output.getvalue(), titles)
+
+    executor = _kill_workers(statement_bytes, sheets, billing_period)
+    archive = io.BytesIO()
+    report_writer.write_employee_archive(archive, sheets, billing_period)
+    with zipfile.ZipFile(archive) as result:
+        assert len(result.namelist()) == len(sheets)
+    assert report_writer._executor is not executor
+
+
+class _CountingExecutor:
+    def __init__(self, executor):
+        self.executor = executor
+        self.submitted = 0
+
+    def submit(self, *args):
+        self.submitted += 1
+        return self.executor.submit(*args)
+
+
+def test_parallel_sheets_are_submitted_in_a_bounded_window(
+    statement_bytes, report, sheet_pool, monkeypatch
+):
+    _, billing_period, sheets = report
+    with zipfile.ZipFile(io.BytesIO(statement_bytes)) as source:
+        _, style_ids = report_writer.add_report_styles(source.read('xl/styles.xml').decode('utf-8'))
+    executor = _CountingExecutor(report_writer.sheet_executor())
+    monkeypatch.setattr(report_writer, 'sheet_executor', lambda: executor)
+    window = report_writer.SHEET_WORKERS * 2
+    assert len(sheets) > window
+
+    # 尚未取用結果前只送出第一批，之後每取出一個才送出下一個
+    rendered = report_writer._render_uncached(sheets, billing_period, style_ids)
+    assert executor.submitted == window
+    results = []
+    for xml in rendered:
+        results.append(xml)
+        assert executor.submitted <= len(results) + window
+    assert executor.submitted == len(sheets)
+    assert results == [
+        report_writer.render_sheet_xml(sheet, billing_period, style_ids) for sheet in sheets
+    ]
@@ -0,0 +1,28 @@
+from datetime import datetime
+import pandas as pd
+from report_writer import sheet_layout
+from statement_pipeline import build_report_sheets, normalize_trip_columns
+
+COLUMNS = ['序號', '乘車時間', '員工編號', '員工姓名', '上車地點', '下車地點', '車資', '折扣後車資']
+
+PERIOD = '2024 年 08 月 01 日 ~ 2024 年 08 月 31 日'
+
+
+def test_date_only_ride_times_keep_column_widths():
+    # 乘車時間全為午夜時會轉為 datetime64，欄寬仍須與原本的 object 欄位相同
+    trips = [
+        [idx + 1, datetime(2024, 8, idx + 1), f'0010{idx % 3}', f'員工{idx % 3}', 'A', 'B', 100, 95]
+        for idx in range(9)
+    ]
+    df = pd.DataFrame(trips, columns=COLUMNS, dtype=object)
+    normalized = normalize_trip_columns(df)[0]
+    assert normalized['乘車時間'].dtype.kind == 'M'
+
+    expected = build_report_sheets(df, {}, {})
+    actual = build_report_sheets(normalized, {}, {})
+    assert [sheet['title'] for sheet in actual] == [sheet['title'] for sheet in expected]
+    for expected_sheet, actual_sheet in zip(expected, actual):
+        assert (
+            sheet_layout(actual_sheet, PERIOD)['widths']
+            == sheet_layout(expected_sheet, PERIOD)['widths']
+        )